@@ -7,6 +7,7 @@ from .base import *
 import os
 import dj_database_url
 import importlib
+from django.core.exceptions import ImproperlyConfigured
 DJANGO_ENV = os.environ.get('DJANGO_ENV')
 print('env is ', DJANGO_ENV)
 
@@ -24,6 +25,22 @@ if 'DATABASE_URL' in os.environ:
     DATABASES['default'] = dj_database_url.config(conn_max_age=600)
     #DATABASES['default'] = dj_database_url.config(os.environ.get('DATABASE_URL'))
 
+# A cache every web process shares (e.g. Heroku Redis), instead of the per process local memory one
+if 'REDIS_URL' in os.environ:
+    CACHES['default'] = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': os.environ['REDIS_URL']}
+
+# Read replicas for GET requests (api/db.py), a comma separated list of database URLs. Locally a second SQLite
+# file works, e.g. DATABASE_REPLICA_URLS=sqlite:////path/to/replica.sqlite3 kept as a copy of db.sqlite3.
+# The pins that send a user's reads to the primary right after they wrote are kept in the cache, and gunicorn
+# workers and dynos each have their own local memory one, so replicas need a shared cache (REDIS_URL) too
+REPLICA_DATABASES = []
+replica_urls = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+if replica_urls and CACHES['default']['BACKEND'].endswith('LocMemCache'):
+    raise ImproperlyConfigured('DATABASE_REPLICA_URLS needs a cache shared by the web processes, set REDIS_URL')
+for i, url in enumerate(replica_urls):
+    DATABASES[f'replica_{i}'] = {**dj_database_url.parse(url, conn_max_age=600), 'TEST': {'MIRROR': 'default'}}
+    REPLICA_DATABASES.append(f'replica_{i}')
+
 
 # Load environment-specific settings
 if DJANGO_ENV:
@@ -68,6 +68,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.db.ReplicaPinningMiddleware', # GET reads go to the read replicas, see api/db.py
 ]
 
 ROOT_URLCONF = APPLICATION_NAME + '.urls'
@@ -145,7 +146,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication', # user from the token claims, see api/authentication.py
     ]
 }
 
@@ -163,4 +164,40 @@ AUTH_USER_MODEL = 'api.CustomUser'
 
 # with 6,4, we get level 0,1,2,3,4,4,4,4,5 --> stored as 0,1,2,3,4,5,6,7,8 .. with 8 being in retirement mode. 
 NUMBER_OF_VISIBLE_LEVELS = 6
-TOP_SCORE_REPEATS = 4 
\ No newline at end of file
+TOP_SCORE_REPEATS = 4
+STUDY_SCHEDULER = 'api.scheduler.LevelScheduler' # see api/scheduler.py
+STUDY_LEVEL_A_INTERVAL = timedelta(days=7) # retired cards come back after this
+STUDY_LEVEL_B_INTERVAL = timedelta(minutes=30) # B level cards, and new cards you just saw, come back after this
+
+# study queue (api/study_queue.py) and replica pins (api/db.py), local memory per process unless REDIS_URL sets a shared one
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'memorycenter',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+STUDY_QUEUE_SIZE = 100 # cards per queue, handed out over several fetches
+STUDY_QUEUE_TIMEOUT = 300 # seconds, queues are rebuilt at least this often so newly due cards show up
+SYNC_PAGE_SIZE = 5000 # changes per sync/ response, the client keeps calling while has_more
+SYNC_COMMIT_WINDOW = timedelta(seconds=30) # sync/ cursors only move past changes this old, so late commits aren't skipped (not on SQLite)
+SYNC_RETENTION = timedelta(days=30) # manage.py prune_changelog (run it daily) drops older changes, older cursors get a full resync
+REVIEW_LOG_FLUSH_SIZE = 500 # buffered review history events are written at the end of the request, or at this many 
+IMPORT_CHUNK_SIZE = 1000 # rows per bulk insert (and transaction) when importing deck files
+EXPORT_CHUNK_SIZE = 2000 # rows per database fetch when streaming export_items/
+JOB_INLINE_LIMIT = 2000 # rows a heavy mutation may touch before it goes to the job worker (manage.py run_jobs)
+JOB_CHUNK_SIZE = 500 # rows per transaction inside a job
+JOB_LEASE = timedelta(minutes=5) # a running job not heard from for this long is picked up again
+JOB_UPLOAD_CHUNK_SIZE = 1024 * 1024 # bytes per database row of a file waiting for the job worker
+USER_CACHE_TIMEOUT = 60 # seconds a fully loaded request.user is cached, saving the user drops it
+SQLITE_PRAGMAS = { # run on every new SQLite connection (api/db.py), {} for SQLite's defaults
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'cache_size': -64000, # 64MB
+    'mmap_size': 256 * 1024 * 1024,
+    'busy_timeout': 5000, # ms a writer waits for the lock
+    'temp_store': 'memory',
+}
+SQLITE_TRANSACTION_MODE = 'IMMEDIATE' # atomic blocks take the SQLite write lock up front, so busy_timeout applies. None for deferred
+DATABASE_ROUTERS = ['api.db.ReplicaRouter'] # replicas come from DATABASE_REPLICA_URLS (settings/__init__.py)
+REPLICA_PIN_SECONDS = 5 # after a write the user reads from the primary for this long, longer than the replication lag (pins are kept in CACHES, which must be shared)
\ No newline at end of file
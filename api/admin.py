@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import CustomUser, TopicTable, CollectionTable, CollectionTopic, ItemTable, UserItem
+from .models import CustomUser, TopicTable, CollectionTable, CollectionTopic, ItemTable, UserItem, ReviewLog, Job
 
 
 admin.site.register(CustomUser)
@@ -7,4 +7,6 @@ admin.site.register(CollectionTable)
 admin.site.register(CollectionTopic)
 admin.site.register(TopicTable)
 admin.site.register(ItemTable)
-admin.site.register(UserItem)
\ No newline at end of file
+admin.site.register(UserItem)
+admin.site.register(ReviewLog)
+admin.site.register(Job)
@@ -0,0 +1,84 @@
+# JWT authentication without the user query. The access token is signed, so its user_id and username claims
+# are trusted as they are: request.user is a CustomUser with just those two fields loaded, and the rest are
+# loaded together the first time a view touches one (CustomUser.refresh_from_db). A loaded user is kept in
+# django's cache for USER_CACHE_TIMEOUT seconds, so the next requests get it whole without a query, and
+# dropped from it whenever the user is saved (edit_profile/, a password change).
+#
+# Tokens get the username claim from tokens_for(). Tokens without it (issued before), or a CHECK_REVOKE_TOKEN
+# setup that needs the password hash, fall back to the usual lookup. A deactivated user keeps access until
+# their token runs out, unless they are in the cache.
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import CustomUser, user_loaded
+from . import db
+
+
+USER_CACHE_TIMEOUT = getattr(settings, 'USER_CACHE_TIMEOUT', 60)
+USERNAME_CLAIM = 'username'
+
+
+# refresh token (and through it the access tokens) for login/ and register/
+def tokens_for(user):
+    refresh = RefreshToken.for_user(user)
+    refresh[USERNAME_CLAIM] = user.username
+    return refresh
+
+
+def _key(user_id):
+    return f'auth_user:{user_id}'
+
+
+def _build(field_names, values):
+    return CustomUser.from_db(router.db_for_read(CustomUser), field_names, values)
+
+
+def cache_user(user):
+    fields = CustomUser._meta.concrete_fields
+    cache.set(_key(user.pk), {field.attname: getattr(user, field.attname) for field in fields}, USER_CACHE_TIMEOUT)
+
+
+def forget_user(user_id):
+    cache.delete(_key(user_id))
+
+
+@receiver(user_loaded, sender=CustomUser)
+def _cache_loaded_user(sender, user, **kwargs):
+    cache_user(user)
+
+
+@receiver(post_save, sender=CustomUser)
+def _forget_saved_user(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+        db.user_authenticated(user_id) # before any query, it decides whether they go to a replica
+
+        values = cache.get(_key(user_id))
+        if values is not None:
+            user = _build(list(values), list(values.values()))
+            if not user.is_active:
+                raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+            if not api_settings.CHECK_REVOKE_TOKEN:
+                return user
+
+        username = validated_token.get(USERNAME_CLAIM)
+        if username is None or api_settings.CHECK_REVOKE_TOKEN:
+            user = super().get_user(validated_token)
+            cache_user(user)
+            return user
+        return _build([api_settings.USER_ID_FIELD, 'username'], [user_id, username])
@@ -0,0 +1,71 @@
+# cards (ItemTable rows) can be shared: the same item linked into several topics, by content_hash
+# deduplication on add/import or by subscribing to someone's deck. These are the helpers that keep that safe,
+# finding existing copies of a card, and taking cards out of a topic without deleting them from the others.
+from django.db.models import Exists, OuterRef
+
+from .models import ChangeLog, ItemTable, TopicItem, content_hash, viewable_filter
+from . import sync
+
+
+DUPLICATE_MODES = ('create', 'link', 'skip') # make a new card anyway / reuse the existing one / leave it out
+
+
+# {content_hash: item id} for cards with these hashes the user can see (in their own topics or shared ones),
+# the oldest one per hash, one query whatever the batch size
+def existing_items(user, hashes):
+    if not hashes:
+        return {}
+    visible = TopicItem.objects.filter(item=OuterRef('pk')).filter(viewable_filter(user, 'topic__'))
+    found = {}
+    for hash, id in ItemTable.objects.filter(content_hash__in=hashes).filter(Exists(visible)).order_by('-id').values_list('content_hash', 'id'):
+        found[hash] = id
+    return found
+
+
+# plan a batch of new (front, back) pairs against what exists, returns
+#   new:        indexes of the pairs to create
+#   links:      {index: existing item id} to link into the topic (mode 'link' only, not already in it)
+#   duplicates: {index: existing item id} for pairs that already have a card
+#   repeats:    {index: index of the same card earlier in this batch}
+def plan_duplicates(user, topic, pairs, mode):
+    hashes = [content_hash(front, back) for front, back in pairs]
+    existing = existing_items(user, set(hashes))
+    in_topic = set(TopicItem.objects.filter(topic=topic, item_id__in=existing.values()).values_list('item_id', flat=True)) if existing else set()
+
+    new, links, duplicates, repeats, first_index = [], {}, {}, {}, {}
+    for index, hash in enumerate(hashes):
+        item_id = existing.get(hash)
+        if item_id is not None:
+            duplicates[index] = item_id
+        elif hash in first_index:
+            repeats[index] = first_index[hash]
+        else:
+            first_index[hash] = index
+            new.append(index)
+            continue
+        if mode == 'create':
+            new.append(index)
+        elif mode == 'link' and item_id is not None and item_id not in in_topic:
+            links[index] = item_id
+            in_topic.add(item_id)
+    return new, links, duplicates, repeats
+
+
+# take the items out of the topic, deleting the ones no other topic holds (with their scores).
+# Records the changes for sync, returns how many items were deleted outright
+def detach_from_topic(topic_id, item_ids):
+    topic_items = list(TopicItem.objects.filter(topic_id=topic_id, item_id__in=item_ids).values_list('id', 'item_id', 'topic__user_id'))
+    if not topic_items:
+        return 0
+    shared = shared_elsewhere(topic_id, item_ids)
+    orphans = [item_id for _, item_id, _ in topic_items if item_id not in shared]
+    sync.record_deletes(ChangeLog.TOPIC_ITEM, [(id, topic_id, owner_id) for id, _, owner_id in topic_items], 'topic_id')
+    sync.record_item_deletes(orphans)
+    ItemTable.objects.filter(id__in=orphans).delete()
+    TopicItem.objects.filter(id__in=[id for id, _, _ in topic_items]).delete()
+    return len(orphans)
+
+
+# item ids among these that some other topic holds too, editing them in place would change that topic as well
+def shared_elsewhere(topic_id, item_ids):
+    return set(TopicItem.objects.filter(item_id__in=item_ids).exclude(topic_id=topic_id).values_list('item_id', flat=True))
@@ -0,0 +1,117 @@
+# database connection setup: SQLite tuning, and read replicas.
+#
+# SQLite (the fallback when there is no DATABASE_URL, and single node deployments) gets the SQLITE_PRAGMAS
+# on every new connection: WAL so readers don't wait on writers and the other way round, synchronous=NORMAL
+# (safe with WAL, a commit is only not durable across a power loss), a bigger page cache, mmap'd reads, and
+# busy_timeout so a writer waits for the lock instead of failing with "database is locked" straight away.
+# SQLITE_PRAGMAS = {} leaves SQLite at its defaults. journal_mode is kept in the database file, so going back
+# from WAL takes {'journal_mode': 'delete'} rather than just leaving it out.
+#
+# busy_timeout only helps a transaction that asks for the write lock up front. One that reads first (every
+# atomic block here does) and then writes fails at once if another writer got in between, so with
+# SQLITE_TRANSACTION_MODE = 'IMMEDIATE' atomic blocks start with BEGIN IMMEDIATE, as Django 5.1's
+# "transaction_mode" OPTION does. None keeps the plain (deferred) BEGIN.
+import random
+import threading
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_finished
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def sqlite_pragmas():
+    return getattr(settings, 'SQLITE_PRAGMAS', {})
+
+
+def sqlite_transaction_mode():
+    return getattr(settings, 'SQLITE_TRANSACTION_MODE', None)
+
+
+@receiver(connection_created, dispatch_uid='api_sqlite_pragmas')
+def _configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in sqlite_pragmas().items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+    # backport of the "transaction_mode" OPTION of Django 5.1, drop this for OPTIONS={'transaction_mode': ...} once on 5.1+.
+    # It replaces the private hook atomic() starts SQLite transactions with, test 29 checks Django still calls it
+    mode = sqlite_transaction_mode()
+    if mode and django.VERSION < (5, 1):
+        def start_transaction():
+            connection.cursor().execute(f'BEGIN {mode}')
+        connection._start_transaction_under_autocommit = start_transaction
+    elif mode and connection.transaction_mode is None:
+        connection.transaction_mode = mode
+
+
+# Read replicas (REPLICA_DATABASES, from DATABASE_REPLICA_URLS in settings/__init__.py). The reads of a GET/HEAD/OPTIONS
+# request go to one replica, picked at random for the whole request so its queries all see the same point of
+# replication. Everything else goes to 'default': writes, every query of other requests, and the job worker and
+# commands, which run outside of requests. A request pins itself to the primary as soon as it writes, and the
+# user is pinned for REPLICA_PIN_SECONDS after it (a key in django's cache, checked by CachedJWTAuthentication
+# once it knows who is asking), so their next reads see what they just wrote rather than a replica that hasn't
+# caught up. Every web process has to see the pin, so replicas are refused without a shared cache (REDIS_URL).
+# Streamed response bodies are read after the request, from the primary.
+REPLICA_PIN_SECONDS = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_request = threading.local()
+
+
+def replica_databases():
+    return getattr(settings, 'REPLICA_DATABASES', [])
+
+
+def _pin_key(user_id):
+    return f'replica_pin:{user_id}'
+
+
+# the request's user is known, their reads stay on the primary for a while after they wrote
+def user_authenticated(user_id):
+    _request.user_id = user_id
+    if getattr(_request, 'replica', None) and cache.get(_pin_key(user_id)):
+        _request.replica = None
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return getattr(_request, 'replica', None) or 'default'
+
+    def db_for_write(self, model, **hints):
+        _request.replica = None
+        _request.wrote = True
+        return 'default'
+
+    # the same data everywhere
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    # replicas get their schema by replication
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replica_databases()
+
+
+class ReplicaPinningMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        replicas = replica_databases()
+        _request.replica = random.choice(replicas) if replicas and request.method in SAFE_METHODS else None
+        _request.wrote = False
+        _request.user_id = None
+        response = self.get_response(request)
+        if replicas and _request.user_id is not None and (_request.wrote or request.method not in SAFE_METHODS):
+            cache.set(_pin_key(_request.user_id), True, REPLICA_PIN_SECONDS)
+        _request.replica = None
+        return response
+
+
+@receiver(request_finished, dispatch_uid='api_replica_unpin')
+def _end_request(sender, **kwargs):
+    _request.replica = None
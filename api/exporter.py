@@ -0,0 +1,77 @@
+# streaming export of a collection (or a single topic) with its topics, items and the caller's scores.
+# Everything is generated lazily over .iterator(chunk_size=EXPORT_CHUNK_SIZE) (a server side cursor on
+# PostgreSQL), so export_items/ sends its first bytes right away and holds one chunk in memory at a time.
+#
+#   ndjson: one JSON object per line, a "collection" line, then "topic" lines, then "item" lines
+#   csv:    front,back,topic,score,last_seen, which import_items/ reads back (score/last_seen are ignored there)
+import csv
+import json
+
+from django.conf import settings
+from django.db.models import FilteredRelation, Q
+
+from .models import TopicTable, TopicItem
+from .scheduler import get_scheduler
+from .fast_serializers import datetime_formatter
+
+
+EXPORT_CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+# (topic_id, item_id, front, back, score, last_seen) for every item in the topics, score/last_seen are
+# the user's (None if they have never studied it), one LEFT JOIN instead of a lookup per item
+def _item_rows(user, topic_ids):
+    return (
+        TopicItem.objects.filter(topic_id__in=topic_ids)
+        .annotate(own=FilteredRelation('item__useritem', condition=Q(item__useritem__user=user)))
+        .order_by('topic_id', 'id')
+        .values_list('topic_id', 'item_id', 'item__front', 'item__back', 'own__score', 'own__last_seen')
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+
+
+def _items(user, topic_ids):
+    client_score = get_scheduler().client_score
+    to_datetime = datetime_formatter()
+    for topic_id, item_id, front, back, score, last_seen in _item_rows(user, topic_ids):
+        yield {
+            'topic': topic_id, 'id': item_id, 'front': front, 'back': back,
+            'score': None if score is None else client_score(score),
+            'last_seen': None if last_seen is None else to_datetime(last_seen),
+        }
+
+
+def _topics(topic_ids):
+    return TopicTable.objects.filter(id__in=topic_ids).order_by('id').values('id', 'topic_name', 'description', 'visibility').iterator()
+
+
+def ndjson_lines(user, collection, topic_ids):
+    if collection is not None:
+        yield json.dumps({
+            'type': 'collection', 'id': collection.id, 'collection_name': collection.collection_name,
+            'description': collection.description, 'visibility': collection.visibility,
+            'active_topics': list(collection.collectiontopic_set.filter(is_active=True, topic_id__in=topic_ids).values_list('topic_id', flat=True)),
+        }) + '\n'
+    for topic in _topics(topic_ids):
+        yield json.dumps({'type': 'topic', **topic}) + '\n'
+    for item in _items(user, topic_ids):
+        yield json.dumps({'type': 'item', **item}) + '\n'
+
+
+# csv.writer wants a file, this one hands back each formatted row instead of storing it
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def csv_lines(user, collection, topic_ids):
+    writer = csv.writer(_Echo())
+    topic_names = dict(TopicTable.objects.filter(id__in=topic_ids).values_list('id', 'topic_name'))
+    yield writer.writerow(['front', 'back', 'topic', 'score', 'last_seen'])
+    for item in _items(user, topic_ids):
+        yield writer.writerow([item['front'], item['back'], topic_names[item['topic']], item['score'], item['last_seen']])
+
+
+def export_lines(export_format, user, collection, topic_ids):
+    return (ndjson_lines if export_format == 'ndjson' else csv_lines)(user, collection, topic_ids)
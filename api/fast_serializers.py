@@ -0,0 +1,56 @@
+# read only fast paths for the hot list endpoints (get_all_items, get_topic_items, fetch_n_from_collection).
+# They pull flat tuples with values_list and build the same dicts the DRF serializers would (same keys in the
+# same order, same datetime and score formatting), so the JSON is byte for byte what UserItemSerializer /
+# ItemTableSerializer give, without a model instance and a field pass per row.
+# If you add a field to those serializers, add it here too, tests.FastSerializerTestCase compares the two.
+from collections import defaultdict
+
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+from .models import UserItem, TopicItem
+from .scheduler import get_scheduler
+
+
+_datetime_field = serializers.DateTimeField()
+
+
+# DateTimeField.to_representation looks the current timezone up on every call, which ends up being most
+# of the cost for long lists, so for the usual case (aware datetimes, ISO output) do it once per list
+def datetime_formatter():
+    field_timezone = _datetime_field.default_timezone()
+    output_format = api_settings.DATETIME_FORMAT
+    if field_timezone is None or not isinstance(output_format, str) or output_format.lower() != ISO_8601:
+        return _datetime_field.to_representation
+
+    def to_datetime(value):
+        value = value.astimezone(field_timezone).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    return to_datetime
+
+
+# same as UserItemSerializer(user_items, many=True).data
+def user_item_rows(user_items):
+    to_datetime = datetime_formatter()
+    client_score = get_scheduler().client_score
+    return [
+        {'id': id, 'user': user_id, 'last_seen': to_datetime(last_seen), 'score': client_score(score), 'front': front, 'back': back}
+        for id, user_id, last_seen, score, front, back
+        in user_items.values_list('id', 'user_id', 'last_seen', 'score', 'item__front', 'item__back')
+    ]
+
+
+# same as [ItemTableSerializer(topic_item.item).data for topic_item in topic_items], three queries whatever the size
+def topic_item_rows(topic_items):
+    rows = list(topic_items.values_list('item_id', 'item__front', 'item__back'))
+    item_ids = topic_items.values('item_id')
+    users = defaultdict(list)
+    for item_id, user_id in UserItem.objects.filter(item_id__in=item_ids).order_by('id').values_list('item_id', 'user_id'):
+        users[item_id].append(user_id)
+    topics = defaultdict(list)
+    for item_id, topic_id in TopicItem.objects.filter(item_id__in=item_ids).order_by('id').values_list('item_id', 'topic_id'):
+        topics[item_id].append(topic_id)
+    return [
+        {'id': id, 'front': front, 'back': back, 'users': users[id], 'topics': topics[id]}
+        for id, front, back in rows
+    ]
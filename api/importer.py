@@ -0,0 +1,214 @@
+# streaming import of decks from delimited text: CSV, TSV, or Anki's "Notes in Plain Text" export.
+# Rows are read one at a time and written in IMPORT_CHUNK_SIZE bulk inserts, each chunk its own transaction
+# together with the progress call (the job's checkpoint), so memory stays flat whatever the file size and an
+# interrupted import keeps the chunks already written, and knows which they are.
+#
+# Columns are front, back and optionally a topic name (Anki's "#deck column:N" header, or a header row
+# naming a topic/deck column). Rows with a topic name go to the user's topic of that name, created if needed,
+# the others to the default topic. Bad rows are skipped and reported by line, they don't stop the import.
+# Cards the user can already see are counted as duplicates, and with on_duplicate 'link' or 'skip' reused or left out.
+import csv
+import io
+import itertools
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import ChangeLog, ItemTable, UserItem, TopicTable, TopicItem, content_hash
+from . import cards, study_queue, sync
+
+
+IMPORT_CHUNK_SIZE = getattr(settings, 'IMPORT_CHUNK_SIZE', 1000)
+IMPORT_MAX_ERRORS = 100 # errors listed in the result, the rest are only counted
+
+ITEM_SIDE_MAX_LENGTH = ItemTable._meta.get_field('front').max_length
+TOPIC_NAME_MAX_LENGTH = TopicTable._meta.get_field('topic_name').max_length
+
+# Anki's #separator: names, anything else is taken as the character itself
+SEPARATORS = {'comma': ',', 'semicolon': ';', 'tab': '\t', 'space': ' ', 'pipe': '|', 'colon': ':'}
+
+
+def _parse_separator(value):
+    value = value.strip()
+    return SEPARATORS.get(value.lower(), value[:1] or ',')
+
+
+# (line number, fields) for every data row of a text stream, with Anki '#' headers read and dropped
+def read_rows(lines, delimiter=None):
+    lines = iter(lines)
+    topic_column = None
+    header_lines = 0
+    for line in lines:
+        if not line.startswith('#'):
+            break
+        header_lines += 1
+        key, _, value = line[1:].partition(':')
+        if key.strip().lower() == 'separator':
+            delimiter = delimiter or _parse_separator(value)
+        elif key.strip().lower() == 'deck column' and value.strip().isdigit():
+            topic_column = int(value) - 1
+    else:
+        return None, iter(())
+
+    delimiter = delimiter or ('\t' if '\t' in line else ',')
+    reader = csv.reader(itertools.chain([line], lines), delimiter=delimiter)
+    return topic_column, ((header_lines + reader.line_num, row) for row in reader)
+
+
+class Importer:
+    # limits are the view's product limits, None (the management command) means unlimited.
+    # resume is the result passed to the last progress call of an interrupted run over the same file
+    def __init__(self, user, default_topic=None, max_items_per_topic=None, max_topics=None, on_duplicate='create', chunk_size=IMPORT_CHUNK_SIZE, progress=None, resume=None):
+        self.user = user
+        self.on_duplicate = on_duplicate
+        self.default_topic = default_topic
+        self.max_items_per_topic = max_items_per_topic
+        self.max_topics = max_topics
+        self.chunk_size = chunk_size
+        self.progress = progress
+
+        self.topics = {} # name -> topic, for the topic column
+        self.topic_counts = {} # topic id -> items in it, including what we added
+        self.result = {'rows': 0, 'imported': 0, 'linked': 0, 'duplicates': 0, 'skipped': 0, 'over_limit': 0, 'error_count': 0, 'errors': [], 'topics_created': [], 'topic_ids': []}
+        self.result.update(resume or {})
+        self.resume_rows = self.result['rows']
+        self.topics_created = self.result['topics_created']
+        self.touched_topic_ids = set(self.result['topic_ids'])
+        if default_topic is not None:
+            self.topic_counts[default_topic.id] = default_topic.items.count()
+
+    def error(self, line, message):
+        self.result['error_count'] += 1
+        if len(self.result['errors']) < IMPORT_MAX_ERRORS:
+            self.result['errors'].append({'line': line, 'error': message})
+
+    def topic_for(self, name, line):
+        name = name.strip()
+        if not name:
+            if self.default_topic is None:
+                self.error(line, 'No topic given and no topic_id to import into.')
+            return self.default_topic
+        if name in self.topics:
+            return self.topics[name]
+        if len(name) > TOPIC_NAME_MAX_LENGTH:
+            self.error(line, f'Topic names can be at most {TOPIC_NAME_MAX_LENGTH} characters.')
+            return None
+        topic = TopicTable.objects.filter(user=self.user, topic_name=name).order_by('id').first()
+        if topic is None:
+            if self.max_topics is not None and TopicTable.objects.filter(user=self.user).count() >= self.max_topics:
+                self.error(line, 'Topic limit reached')
+                return None
+            topic = TopicTable.objects.create(user=self.user, topic_name=name)
+            sync.record(ChangeLog.TOPIC, [topic.id], user_id=self.user.id)
+            self.topics_created.append(topic.id)
+        self.topics[name] = topic
+        self.topic_counts.setdefault(topic.id, topic.items.count())
+        return topic
+
+    # the row as (front, back, topic), or None if it's skipped
+    def parse(self, line, row, topic_column):
+        if len(row) < 2:
+            self.error(line, 'Both front and back should be provided.')
+            return None
+        front, back = row[0], row[1]
+        if not front.strip() or not back.strip():
+            self.result['skipped'] += 1
+            return None
+        if len(front) > ITEM_SIDE_MAX_LENGTH or len(back) > ITEM_SIDE_MAX_LENGTH:
+            self.error(line, f'Front and back can be at most {ITEM_SIDE_MAX_LENGTH} characters.')
+            return None
+        topic_name = row[topic_column] if topic_column is not None and topic_column < len(row) else ''
+        topic = self.topic_for(topic_name, line)
+        if topic is None:
+            return None
+        if self.max_items_per_topic is not None and self.topic_counts[topic.id] >= self.max_items_per_topic:
+            self.result['over_limit'] += 1
+            return None
+        self.topic_counts[topic.id] += 1
+        return front, back, topic
+
+    # split the chunk into rows to create and (item id, topic) links, by the mode. Rows repeating a card
+    # earlier in the chunk count as duplicates too, later chunks see the earlier ones as existing cards
+    def dedupe(self, chunk):
+        hashes = [content_hash(front, back) for front, back, _ in chunk]
+        existing = cards.existing_items(self.user, set(hashes))
+        in_topic = set(
+            TopicItem.objects.filter(topic_id__in={topic.id for _, _, topic in chunk}, item_id__in=existing.values()).values_list('topic_id', 'item_id')
+        ) if existing else set()
+        new, links, seen = [], [], set()
+        for row, hash in zip(chunk, hashes):
+            topic = row[2]
+            item_id = existing.get(hash)
+            if item_id is None and (topic.id, hash) not in seen:
+                seen.add((topic.id, hash))
+                new.append(row)
+                continue
+            self.result['duplicates'] += 1
+            if self.on_duplicate == 'create':
+                new.append(row)
+            elif self.on_duplicate == 'link' and item_id is not None and (topic.id, item_id) not in in_topic:
+                in_topic.add((topic.id, item_id))
+                links.append((item_id, topic))
+            else:
+                self.topic_counts[topic.id] -= 1 # left out, it doesn't count against the limit
+        return new, links
+
+    def write(self, chunk):
+        chunk, links = self.dedupe(chunk)
+        with transaction.atomic():
+            items = ItemTable.objects.bulk_create([ItemTable(front=front, back=back) for front, back, _ in chunk])
+            user_items = UserItem.objects.bulk_create([
+                UserItem(item=item, user_id=user_id) for item, (_, _, topic) in zip(items, chunk) for user_id in dict.fromkeys([self.user.id, topic.user_id])
+            ])
+            topic_items = TopicItem.objects.bulk_create(
+                [TopicItem(item=item, topic=topic) for item, (_, _, topic) in zip(items, chunk)] +
+                [TopicItem(item_id=item_id, topic=topic) for item_id, topic in links]
+            )
+
+            sync.record_scoped(ChangeLog.ITEM, [(topic_item.item_id, topic_item.topic_id) for topic_item in topic_items], 'topic_id')
+            sync.record_scoped(ChangeLog.TOPIC_ITEM, [(topic_item.id, topic_item.topic_id) for topic_item in topic_items], 'topic_id')
+            sync.record_scoped(ChangeLog.USER_ITEM, [(user_item.id, user_item.user_id) for user_item in user_items], 'user_id')
+            self.touched_topic_ids.update(topic.id for _, _, topic in chunk)
+            self.touched_topic_ids.update(topic.id for _, topic in links)
+            self.result['topic_ids'] = sorted(self.touched_topic_ids)
+            self.result['imported'] += len(chunk)
+            self.result['linked'] += len(links)
+            # the checkpoint commits with the chunk, a resumed job never writes a chunk twice
+            if self.progress:
+                self.progress(self.result)
+
+    def run(self, lines, delimiter=None):
+        topic_column, rows = read_rows(lines, delimiter)
+        chunk = []
+        seen = 0
+        for line, row in rows:
+            if not any(field.strip() for field in row):
+                continue
+            # a header row naming the columns is used, not imported
+            if seen == 0 and [field.strip().lower() for field in row[:2]] == ['front', 'back']:
+                names = [field.strip().lower() for field in row]
+                topic_column = next((i for i, name in enumerate(names) if name in ('topic', 'deck')), topic_column)
+                continue
+            seen += 1
+            if seen <= self.resume_rows:
+                continue # written by the interrupted run
+            self.result['rows'] += 1
+            parsed = self.parse(line, row, topic_column)
+            if parsed is not None:
+                chunk.append(parsed)
+            if len(chunk) >= self.chunk_size:
+                self.write(chunk)
+                chunk = []
+        if chunk:
+            self.write(chunk)
+        study_queue.invalidate_topics(self.touched_topic_ids)
+        return self.result
+
+
+# binary file (upload or open(path, 'rb')) to text lines without reading it all in
+def text_lines(binary_file, encoding='utf-8-sig'):
+    return io.TextIOWrapper(binary_file, encoding=encoding, newline='')
+
+
+def import_file(user, binary_file, delimiter=None, **kwargs):
+    return Importer(user, **kwargs).run(text_lines(binary_file), delimiter=delimiter)
@@ -0,0 +1,212 @@
+# background jobs for mutations too big for the request thread, kept in the Job table (no broker needed)
+# and run by `manage.py run_jobs`. Views call submit(), which runs small jobs straight away and queues
+# the rest, answering with the job for get_job/ to follow.
+#
+# A handler gets the job and a checkpoint(progress) callback. It must work in chunks, each in its own
+# transaction followed by checkpoint, and only ever look at what is left to do: a worker that dies
+# mid job leaves its lease to run out, and the next worker runs the handler again from the top.
+#
+# Files a job needs (deck uploads) are kept in the database as JobUpload chunks, written one chunk at a time
+# and read back the same way (UploadReader), and deleted when the job is done or failed.
+import io
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Job, JobUpload, ChangeLog, CollectionTopic, TopicItem, TopicTable, SHARED_VISIBILITIES
+from .importer import Importer, text_lines
+from . import cards, study_queue, sync
+
+
+JOB_CHUNK_SIZE = getattr(settings, 'JOB_CHUNK_SIZE', 500)
+JOB_INLINE_LIMIT = getattr(settings, 'JOB_INLINE_LIMIT', 2000)
+JOB_LEASE = getattr(settings, 'JOB_LEASE', timedelta(minutes=5))
+JOB_MAX_ATTEMPTS = getattr(settings, 'JOB_MAX_ATTEMPTS', 3)
+JOB_UPLOAD_CHUNK_SIZE = getattr(settings, 'JOB_UPLOAD_CHUNK_SIZE', 1024 * 1024)
+
+HANDLERS = {}
+
+
+def handler(kind):
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+# run it now if it touches at most JOB_INLINE_LIMIT rows (returns None), queue it otherwise (returns the Job)
+def submit(kind, user, payload, size):
+    if size <= JOB_INLINE_LIMIT:
+        HANDLERS[kind](Job(kind=kind, user=user, payload=payload), lambda progress: None)
+        return None
+    return enqueue(kind, user, payload)
+
+
+# upload is a file for the handler, copied into JobUpload rows a chunk at a time rather than read into memory.
+# The job is only there for the worker once all of it is
+def enqueue(kind, user, payload, upload=None):
+    with transaction.atomic():
+        job = Job.objects.create(kind=kind, user=user, payload=payload)
+        if upload is not None:
+            upload.seek(0)
+            for seq, chunk in enumerate(iter(lambda: upload.read(JOB_UPLOAD_CHUNK_SIZE), b'')):
+                JobUpload.objects.create(job=job, seq=seq, data=chunk)
+    return job
+
+
+# the job's upload as a binary file, fetching one chunk at a time
+class UploadReader(io.RawIOBase):
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.seq = 0
+        self.chunk = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self.chunk:
+            data = JobUpload.objects.filter(job_id=self.job_id, seq=self.seq).values_list('data', flat=True).first()
+            if data is None:
+                return 0
+            self.seq += 1
+            self.chunk = memoryview(bytes(data))
+        n = min(len(buffer), len(self.chunk))
+        buffer[:n] = self.chunk[:n]
+        self.chunk = self.chunk[n:]
+        return n
+
+
+def _checkpoint(job):
+    def checkpoint(progress):
+        job.progress = progress
+        job.lease_until = timezone.now() + JOB_LEASE
+        Job.objects.filter(id=job.id).update(progress=progress, lease_until=job.lease_until)
+    return checkpoint
+
+
+# take the oldest queued job, or a running one whose worker stopped renewing its lease.
+# The conditional UPDATE is the lock, two workers can't both get the same job
+def claim():
+    now = timezone.now()
+    claimable = Q(status=Job.QUEUED) | Q(status=Job.RUNNING, lease_until__lt=now)
+    for id, attempts in Job.objects.filter(claimable).order_by('id').values_list('id', 'attempts')[:10]:
+        claimed = Job.objects.filter(claimable, id=id, attempts=attempts).update(
+            status=Job.RUNNING, attempts=attempts + 1, started_at=now, lease_until=now + JOB_LEASE,
+        )
+        if claimed:
+            return Job.objects.get(id=id)
+    return None
+
+
+def run(job):
+    if job.attempts > JOB_MAX_ATTEMPTS:
+        job.status, job.error = Job.FAILED, 'Gave up after the worker stopped during every attempt'
+    else:
+        try:
+            HANDLERS[job.kind](job, _checkpoint(job))
+            job.status, job.error = Job.DONE, ''
+        except Exception as e:
+            print(f'Job {job.id} ({job.kind}) failed: {e}')
+            job.status, job.error = Job.FAILED, traceback.format_exc()
+    job.finished_at = timezone.now()
+    job.lease_until = None
+    job.save(update_fields=['status', 'error', 'finished_at', 'lease_until'])
+    JobUpload.objects.filter(job=job).delete()
+    return job
+
+
+# run jobs until there are none left (or limit of them), returns how many ran
+def run_pending(limit=None):
+    ran = 0
+    while limit is None or ran < limit:
+        job = claim()
+        if job is None:
+            break
+        run(job)
+        ran += 1
+    return ran
+
+
+def job_data(job):
+    return {
+        'id': job.id, 'kind': job.kind, 'status': job.status, 'progress': job.progress,
+        'error': job.error.strip().splitlines()[-1] if job.error else '',
+        'created_at': job.created_at, 'started_at': job.started_at, 'finished_at': job.finished_at,
+    }
+
+
+# handlers
+
+# the topic, its place in collections, its items, and the items nobody else holds
+@handler('delete_topic')
+def delete_topic(job, checkpoint):
+    topic = TopicTable.objects.filter(id=job.payload['topic_id']).first()
+    if topic is None:
+        return
+    progress = {'collection_topics': 0, 'topic_items': 0, 'orphans': 0, **job.progress}
+
+    while True:
+        with transaction.atomic():
+            collection_topics = list(CollectionTopic.objects.filter(topic=topic).values_list('id', 'collection_id')[:JOB_CHUNK_SIZE])
+            if not collection_topics:
+                break
+            sync.record_collection_topic_deletes(CollectionTopic.objects.filter(id__in=[id for id, _ in collection_topics]))
+            CollectionTopic.objects.filter(id__in=[id for id, _ in collection_topics]).delete()
+        study_queue.invalidate_collections(collection_id for _, collection_id in collection_topics)
+        progress['collection_topics'] += len(collection_topics)
+        checkpoint(progress)
+
+    while True:
+        with transaction.atomic():
+            topic_items = list(TopicItem.objects.filter(topic=topic).values_list('id', 'item_id')[:JOB_CHUNK_SIZE])
+            if not topic_items:
+                break
+            orphans = cards.detach_from_topic(topic.id, [item_id for _, item_id in topic_items])
+        progress['topic_items'] += len(topic_items)
+        progress['orphans'] += orphans
+        checkpoint(progress)
+
+    with transaction.atomic():
+        sync.record(ChangeLog.TOPIC, [topic.id], user_id=topic.user_id)
+        topic.delete()
+
+
+# a topic that stopped being shared leaves the collections of everybody but its owner
+@handler('topic_visibility')
+def topic_visibility(job, checkpoint):
+    topic = TopicTable.objects.filter(id=job.payload['topic_id']).first()
+    if topic is None or topic.visibility in SHARED_VISIBILITIES:
+        return
+    progress = {'collection_topics': 0, **job.progress}
+    while True:
+        with transaction.atomic():
+            collection_topics = list(
+                CollectionTopic.objects.filter(topic=topic).exclude(collection__user_id=topic.user_id)
+                .values_list('id', 'collection_id')[:JOB_CHUNK_SIZE]
+            )
+            if not collection_topics:
+                break
+            sync.record_collection_topic_deletes(CollectionTopic.objects.filter(id__in=[id for id, _ in collection_topics]))
+            CollectionTopic.objects.filter(id__in=[id for id, _ in collection_topics]).delete()
+        study_queue.invalidate_collections(collection_id for _, collection_id in collection_topics)
+        progress['collection_topics'] += len(collection_topics)
+        checkpoint(progress)
+
+
+# a deck file uploaded to import_items/, picks up after the last committed chunk
+@handler('import_items')
+def import_items(job, checkpoint):
+    payload = job.payload
+    topic = TopicTable.objects.filter(id=payload['topic_id']).first() if payload.get('topic_id') else None
+    importer = Importer(
+        job.user, default_topic=topic, max_items_per_topic=payload.get('max_items_per_topic'),
+        max_topics=payload.get('max_topics'), on_duplicate=payload.get('on_duplicate', 'create'), progress=checkpoint, resume=job.progress or None,
+    )
+    with io.BufferedReader(UploadReader(job.id)) as upload:
+        result = importer.run(text_lines(upload), delimiter=payload.get('delimiter'))
+    checkpoint(result)
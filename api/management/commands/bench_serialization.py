@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api import fast_serializers
+from api.models import CustomUser, ItemTable, UserItem, TopicTable, TopicItem
+from api.serializers import UserItemSerializer, ItemTableSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+# rows/sec of the DRF serializers against the values_list fast paths, on throwaway rows that are rolled back afterwards
+class Command(BaseCommand):
+    help = 'Compare DRF and fast_serializers throughput for get_all_items and get_topic_items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options['rows'], options['repeat'])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def timed(self, label, rows, repeat, fn):
+        best = min(self.time_once(fn) for _ in range(repeat))
+        self.stdout.write(f'{label:<40} {rows / best:>12,.0f} rows/sec  ({best * 1000:.1f} ms)')
+        return best
+
+    def time_once(self, fn):
+        start = time.perf_counter()
+        fn()
+        return time.perf_counter() - start
+
+    def run(self, n_rows, repeat):
+        user = CustomUser.objects.create_user(username='bench_serialization_user')
+        topic = TopicTable.objects.create(user=user, topic_name='bench')
+        items = ItemTable.objects.bulk_create([ItemTable(front=f'front {i}', back=f'back {i}') for i in range(n_rows)])
+        UserItem.objects.bulk_create([UserItem(user=user, item=item) for item in items])
+        TopicItem.objects.bulk_create([TopicItem(topic=topic, item=item) for item in items])
+
+        user_items = UserItem.objects.filter(user=user)
+        topic_items = TopicItem.objects.filter(topic=topic)
+        drf = self.timed('get_all_items, UserItemSerializer', n_rows, repeat, lambda: UserItemSerializer(user_items, many=True).data)
+        fast = self.timed('get_all_items, user_item_rows', n_rows, repeat, lambda: fast_serializers.user_item_rows(user_items))
+        self.stdout.write(f'{"":<40} {drf / fast:>12.1f}x')
+        drf = self.timed('get_topic_items, ItemTableSerializer', n_rows, repeat, lambda: [ItemTableSerializer(ti.item).data for ti in topic_items])
+        fast = self.timed('get_topic_items, topic_item_rows', n_rows, repeat, lambda: fast_serializers.topic_item_rows(topic_items))
+        self.stdout.write(f'{"":<40} {drf / fast:>12.1f}x')
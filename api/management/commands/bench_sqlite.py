@@ -0,0 +1,123 @@
+import os
+import tempfile
+import threading
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api import review_log, views
+from api.db import sqlite_pragmas, sqlite_transaction_mode
+from api.models import CustomUser, ItemTable, UserItem, TopicTable, TopicItem
+
+
+# SQLite as it comes, the journal_mode has to be set back explicitly as it is kept in the file
+BASELINE_PRAGMAS = {'journal_mode': 'delete', 'synchronous': 'full'}
+
+
+# requests/sec of update_n_items_user writers running next to get_all_topics readers, all in threads with their
+# own connections, on a scratch SQLite file per profile: SQLite's defaults, then SQLITE_PRAGMAS and SQLITE_TRANSACTION_MODE (api/db.py)
+class Command(BaseCommand):
+    help = 'Concurrent write/read throughput on SQLite with and without the SQLITE_PRAGMAS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--items', type=int, default=2000, help='cards per user')
+        parser.add_argument('--batch', type=int, default=10, help='cards reviewed per update_n_items_user call')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('bench_sqlite runs on SQLite, unset DATABASE_URL')
+        settings_dict = connections.settings['default']
+        original_name = settings_dict['NAME']
+        results = {}
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                for label, pragmas, mode in [('defaults', BASELINE_PRAGMAS, None), ('SQLITE_PRAGMAS', sqlite_pragmas(), sqlite_transaction_mode())]:
+                    connections.close_all()
+                    settings_dict['NAME'] = os.path.join(directory, f'{label}.sqlite3')
+                    with override_settings(SQLITE_PRAGMAS=pragmas, SQLITE_TRANSACTION_MODE=mode):
+                        results[label] = self.run(options)
+                    self.report(label, results[label])
+                connections.close_all()
+        finally:
+            settings_dict['NAME'] = original_name
+
+        before, after = results['defaults'], results['SQLITE_PRAGMAS']
+        for kind in ('writes', 'reads'):
+            ratio = after[kind] / before[kind] if before[kind] else float('inf')
+            self.stdout.write(f'{kind:<8} {ratio:>8.1f}x')
+
+    def report(self, label, result):
+        self.stdout.write(
+            f"{label:<16} writes {result['writes']:>8,.0f}/s  reads {result['reads']:>8,.0f}/s  "
+            f"errors {result['errors']:>5}  ({result['first_error'] or 'none'})"
+        )
+
+    def run(self, options):
+        call_command('migrate', verbosity=0)
+        users = []
+        for i in range(options['writers']):
+            user = CustomUser.objects.create_user(username=f'bench_sqlite_{i}')
+            topic = TopicTable.objects.create(user=user, topic_name='bench')
+            items = ItemTable.objects.bulk_create([ItemTable(front=f'front {n}', back=f'back {n}') for n in range(options['items'])])
+            TopicItem.objects.bulk_create([TopicItem(topic=topic, item=item) for item in items])
+            UserItem.objects.bulk_create([UserItem(user=user, item=item) for item in items])
+            users.append((user, list(UserItem.objects.filter(user=user).values_list('id', flat=True))))
+        connections.close_all()
+
+        factory = APIRequestFactory()
+        counts = {'writes': 0, 'reads': 0, 'errors': 0, 'first_error': None}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + options['seconds']
+
+        def count(kind, response):
+            with lock:
+                if response.status_code == 200:
+                    counts[kind] += 1
+                else:
+                    counts['errors'] += 1
+
+        def failed(kind, error):
+            with lock:
+                counts['errors'] += 1
+                counts['first_error'] = counts['first_error'] or f'{kind}: {error}'
+
+        def write(user, user_item_ids):
+            n = 0
+            while time.perf_counter() < deadline:
+                batch = [user_item_ids[(n + k) % len(user_item_ids)] for k in range(options['batch'])]
+                n += options['batch']
+                request = factory.post('/update_n_items_user/', {'items': [{'item_id': id, 'increment': 1} for id in batch]}, format='json')
+                force_authenticate(request, user=user)
+                try:
+                    count('writes', views.update_n_items_user(request))
+                    review_log.flush() # what request_finished does after a real request
+                except Exception as e:
+                    failed('write', e)
+            connection.close()
+
+        def read(user):
+            while time.perf_counter() < deadline:
+                request = factory.get('/get_all_topics/')
+                force_authenticate(request, user=user)
+                try:
+                    count('reads', views.get_all_topics(request))
+                except Exception as e:
+                    failed('read', e)
+            connection.close()
+
+        threads = [threading.Thread(target=write, args=users[i]) for i in range(options['writers'])]
+        threads += [threading.Thread(target=read, args=(users[i % len(users)][0],)) for i in range(options['readers'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        return {**counts, 'writes': counts['writes'] / elapsed, 'reads': counts['reads'] / elapsed}
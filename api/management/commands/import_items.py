@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import CustomUser, TopicTable
+from api import cards, importer
+
+
+# import a deck file for a user from the server, without the per-topic and per-user limits of the endpoint
+class Command(BaseCommand):
+    help = 'Import a CSV/TSV/Anki text deck file for a user, streamed and written in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--user', required=True, help='username')
+        parser.add_argument('--topic-id', type=int, help='topic for rows without a topic column')
+        parser.add_argument('--delimiter')
+        parser.add_argument('--on-duplicate', choices=cards.DUPLICATE_MODES, default='create', help='cards you already have: create anyway, link the existing one, or skip')
+        parser.add_argument('--chunk-size', type=int, default=importer.IMPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        user = CustomUser.objects.filter(username=options['user']).first()
+        if user is None:
+            raise CommandError(f"No user {options['user']}")
+        if options['delimiter'] is not None and len(options['delimiter']) != 1:
+            raise CommandError('--delimiter should be a single character')
+        topic = None
+        if options['topic_id'] is not None:
+            topic = TopicTable.objects.filter(id=options['topic_id'], user=user).first()
+            if topic is None:
+                raise CommandError(f"{options['user']} has no topic {options['topic_id']}")
+
+        def progress(result):
+            self.stdout.write(f"{result['rows']} rows read, {result['imported']} imported")
+
+        with open(options['path'], 'rb') as f:
+            result = importer.import_file(
+                user, f, delimiter=options['delimiter'], default_topic=topic, on_duplicate=options['on_duplicate'], chunk_size=options['chunk_size'], progress=progress,
+            )
+        self.stdout.write(
+            f"done: {result['imported']} of {result['rows']} rows imported into {len(result['topic_ids'])} topics, "
+            f"{result['linked']} linked, {result['duplicates']} duplicates, {result['skipped']} blank, {result['error_count']} errors"
+        )
+        for error in result['errors']:
+            self.stdout.write(f"  line {error['line']}: {error['error']}")
@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from api import sync
+
+
+# drop sync/ change history past SYNC_RETENTION, run it daily (e.g. Heroku Scheduler) so the ChangeLog doesn't grow forever.
+# Clients whose cursor is older than what is left get a 410 from sync/ and do a full sync
+class Command(BaseCommand):
+    help = 'Delete ChangeLog rows older than SYNC_RETENTION (or --days)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, help='keep this many days instead of SYNC_RETENTION')
+
+    def handle(self, *args, **options):
+        retention = timedelta(days=options['days']) if options['days'] is not None else sync.SYNC_RETENTION
+        pruned = sync.prune(retention)
+        self.stdout.write(f'pruned {pruned} changes')
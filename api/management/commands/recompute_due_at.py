@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.models import UserItem
+from api.scheduler import recompute_due_at
+
+
+# rewrite UserItem.due_at with the current STUDY_SCHEDULER, e.g. after switching schedulers or changing intervals
+class Command(BaseCommand):
+    help = 'Recompute UserItem.due_at for every card (or one user) with the configured scheduler'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='only this user id')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        user_items = UserItem.objects.all()
+        if options['user'] is not None:
+            user_items = user_items.filter(user_id=options['user'])
+        updated = recompute_due_at(user_items, chunk_size=options['chunk_size'])
+        self.stdout.write(f'recomputed due_at for {updated} cards')
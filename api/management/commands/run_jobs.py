@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api import jobs
+
+
+# the job worker, run it next to the web process (Procfile worker:), any number of them can run at once
+class Command(BaseCommand):
+    help = 'Run queued background jobs (big deletes, visibility changes, imports)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='run what is queued, then exit')
+        parser.add_argument('--sleep', type=float, default=2.0, help='seconds between polls when the queue is empty')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections() # a long running process, don't hang on to a connection the database dropped
+            job = jobs.claim()
+            if job is not None:
+                self.stdout.write(f'job {job.id} ({job.kind}), attempt {job.attempts}')
+                jobs.run(job)
+                self.stdout.write(f'job {job.id}: {job.status}')
+            elif options['once']:
+                return
+            else:
+                time.sleep(options['sleep'])
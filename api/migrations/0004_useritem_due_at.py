@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-18 07:17
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+
+# same rule as api.scheduler.LevelScheduler.due_at at the time of writing, done as three set-based UPDATEs
+def backfill_due_at(apps, schema_editor):
+    UserItem = apps.get_model('api', 'UserItem')
+    UserItem.objects.filter(score__lt=4).update(due_at=F('last_seen'))
+    UserItem.objects.filter(score__gte=4, score__lt=8).update(due_at=F('last_seen') + timedelta(minutes=30))
+    UserItem.objects.filter(score__gte=8).update(due_at=F('last_seen') + timedelta(days=7))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_alter_itemtable_back_alter_itemtable_front'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='useritem',
+            name='due_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='useritem',
+            index=models.Index(fields=['user', 'due_at'], name='useritem_user_due_at'),
+        ),
+        migrations.RunPython(backfill_due_at, migrations.RunPython.noop),
+    ]
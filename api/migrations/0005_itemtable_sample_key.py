@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-18 07:18
+
+import api.models
+from django.db import migrations, models
+from django.db.models.functions import Random
+
+
+# AddField evaluates the default once for every existing row, so give them their own keys
+def randomize_sample_keys(apps, schema_editor):
+    ItemTable = apps.get_model('api', 'ItemTable')
+    ItemTable.objects.update(sample_key=Random())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_useritem_due_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itemtable',
+            name='sample_key',
+            field=models.FloatField(db_index=True, default=api.models.random_sample_key),
+        ),
+        migrations.RunPython(randomize_sample_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-18 07:22
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_itemtable_sample_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReviewLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('increment', models.SmallIntegerField()),
+                ('score_before', models.PositiveSmallIntegerField()),
+                ('score_after', models.PositiveSmallIntegerField()),
+                ('last_seen_before', models.DateTimeField()),
+                ('reviewed_at', models.DateTimeField()),
+                ('item', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.itemtable')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'reviewed_at'], name='reviewlog_user_reviewed_at')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-18 07:23
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_reviewlog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('scope_user_id', models.BigIntegerField(null=True)),
+                ('scope_topic_id', models.BigIntegerField(null=True)),
+                ('scope_collection_id', models.BigIntegerField(null=True)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['scope_user_id', 'id'], name='changelog_user_cursor'), models.Index(fields=['scope_topic_id', 'id'], name='changelog_topic_cursor'), models.Index(fields=['scope_collection_id', 'id'], name='changelog_collection_cursor')],
+            },
+        ),
+    ]
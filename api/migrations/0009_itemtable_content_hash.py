@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-18 07:43
+
+import hashlib
+
+from django.db import migrations, models
+
+
+# api.models.content_hash as of this migration, copied so later changes to it don't change what this does
+def content_hash(front, back):
+    normalized = '\x1f'.join(' '.join(side.split()).casefold() for side in (front, back))
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+# hash the existing cards, a chunk at a time
+def backfill_content_hashes(apps, schema_editor):
+    ItemTable = apps.get_model('api', 'ItemTable')
+    last_id = 0
+    while True:
+        items = list(ItemTable.objects.filter(id__gt=last_id).order_by('id').only('id', 'front', 'back')[:2000])
+        if not items:
+            break
+        for item in items:
+            item.content_hash = content_hash(item.front, item.back)
+        ItemTable.objects.bulk_update(items, ['content_hash'])
+        last_id = items[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itemtable',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.RunPython(backfill_content_hashes, migrations.RunPython.noop),
+    ]
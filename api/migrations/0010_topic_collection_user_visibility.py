@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 07:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_itemtable_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='collectiontable',
+            index=models.Index(fields=['user', 'visibility'], name='collection_user_visibility'),
+        ),
+        migrations.AddIndex(
+            model_name='topictable',
+            index=models.Index(fields=['user', 'visibility'], name='topic_user_visibility'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 4.2.7 on 2026-10-18 07:55
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+# (key values, [ids]) for every group of rows sharing the key, ids in the order of order_by
+def duplicate_groups(model, key, order_by):
+    groups = model.objects.values(*key).annotate(rows=Count('id')).filter(rows__gt=1).values_list(*key)
+    for values in groups.iterator():
+        yield values, list(model.objects.filter(**dict(zip(key, values))).order_by(*order_by).values_list('id', flat=True))
+
+
+# keep one row of each duplicate before the unique constraints go on: the most recently studied score,
+# the first membership (active if any of the copies was). The removed rows are logged for sync/ as deletes
+def remove_duplicates(apps, schema_editor):
+    ChangeLog = apps.get_model('api', 'ChangeLog')
+    UserItem = apps.get_model('api', 'UserItem')
+    TopicItem = apps.get_model('api', 'TopicItem')
+    CollectionTopic = apps.get_model('api', 'CollectionTopic')
+
+    for (user_id, _), ids in duplicate_groups(UserItem, ['user_id', 'item_id'], ['-last_seen', '-id']):
+        ChangeLog.objects.bulk_create([ChangeLog(kind='user_item', object_id=id, scope_user_id=user_id) for id in ids[1:]])
+        UserItem.objects.filter(id__in=ids[1:]).delete()
+
+    for (topic_id, _), ids in duplicate_groups(TopicItem, ['topic_id', 'item_id'], ['id']):
+        ChangeLog.objects.bulk_create([ChangeLog(kind='topic_item', object_id=id, scope_topic_id=topic_id) for id in ids[1:]])
+        TopicItem.objects.filter(id__in=ids[1:]).delete()
+
+    for (collection_id, _), ids in duplicate_groups(CollectionTopic, ['collection_id', 'topic_id'], ['id']):
+        is_active = CollectionTopic.objects.filter(id__in=ids, is_active=True).exists()
+        CollectionTopic.objects.filter(id=ids[0]).update(is_active=is_active)
+        ChangeLog.objects.bulk_create([
+            ChangeLog(kind='collection_topic', object_id=id, scope_collection_id=collection_id) for id in ids
+        ])
+        CollectionTopic.objects.filter(id__in=ids[1:]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_topic_collection_user_visibility'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='collectiontopic',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['collection', 'topic'], name='collectiontopic_active'),
+        ),
+        migrations.AddConstraint(
+            model_name='collectiontopic',
+            constraint=models.UniqueConstraint(fields=('collection', 'topic'), name='collectiontopic_collection_topic_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='topicitem',
+            constraint=models.UniqueConstraint(fields=('topic', 'item'), name='topicitem_topic_item_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='useritem',
+            constraint=models.UniqueConstraint(fields=('user', 'item'), name='useritem_user_item_unique'),
+        ),
+    ]
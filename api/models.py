@@ -1,6 +1,54 @@
 from django.db import models
+from django.db.models import Q
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
+from django.dispatch import Signal
+from django.utils import timezone
+import hashlib
+import random
+
+from .scheduler import get_scheduler
+
+
+SHARED_VISIBILITIES = ('global_view', 'global_edit') # what other users can see, global_edit they can change too
+
+
+# rows user can see or change, as a filter on the row's own user/visibility or, with a prefix like 'topic__', a related row's
+def viewable_filter(user, prefix=''):
+    return Q(**{f'{prefix}user': user}) | Q(**{f'{prefix}visibility__in': SHARED_VISIBILITIES})
+
+
+def editable_filter(user, prefix=''):
+    return Q(**{f'{prefix}user': user}) | Q(**{f'{prefix}visibility': 'global_edit'})
+
+
+# permissions checked by the database rather than on loaded objects, for TopicTable and CollectionTable.
+# Lookups by owner go through the (user, visibility) index
+class VisibilityQuerySet(models.QuerySet):
+    def viewable_by(self, user):
+        return self.filter(viewable_filter(user))
+
+    def editable_by(self, user):
+        return self.filter(editable_filter(user))
+
+    # owner's rows that user can see, all of them for the owner, only the shared ones for everybody else
+    def owned_by(self, owner, user):
+        if owner.pk == user.pk:
+            return self.filter(user=owner)
+        return self.filter(user=owner, visibility__in=SHARED_VISIBILITIES)
+
+
+def random_sample_key():
+    return random.random()
+
+
+# same card whatever the case and spacing, for finding duplicates (ItemTable.content_hash)
+def content_hash(front, back):
+    normalized = '\x1f'.join(' '.join(side.split()).casefold() for side in (front, back))
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+user_loaded = Signal() # sent with user= when a CustomUser built from token claims had its other fields loaded
 
 
 class CustomUser(AbstractUser):
@@ -8,21 +56,54 @@ class CustomUser(AbstractUser):
     description = models.CharField(max_length=200, blank=True)
     awards = models.JSONField(blank=True, default=list)
 
+    # request.user comes from the token claims with only id and username loaded (api.authentication).
+    # Touching any other field loads all of them in one query, rather than one query per field
+    def refresh_from_db(self, using=None, fields=None):
+        deferred = self.get_deferred_fields()
+        if fields is not None and deferred and set(fields) <= deferred:
+            super().refresh_from_db(using, deferred)
+            user_loaded.send(sender=CustomUser, user=self)
+        else:
+            super().refresh_from_db(using, fields)
+
 # backward map to TopicTable.topics
 class ItemTable(models.Model):
     front = models.CharField(max_length=200)
     back = models.CharField(max_length=200)
     users = models.ManyToManyField(settings.AUTH_USER_MODEL, through='UserItem', related_name='items')
+    sample_key = models.FloatField(default=random_sample_key, db_index=True) # stored random sort key for sampling new cards
+    content_hash = models.CharField(max_length=64, db_index=True, blank=True) # content_hash(front, back), set on construction and save, list it in bulk_update
     # these concepts should probably be a subtable. 
     #conceptid = models.IntegerField() # id for gropuing items as the same effective concept, for future multimodal expansion
     #conceptname = models.CharField(max_length=20) # the name for the concept .. future
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.content_hash and 'front' in kwargs and 'back' in kwargs:
+            self.content_hash = content_hash(self.front, self.back)
+
+    def save(self, *args, **kwargs):
+        self.content_hash = content_hash(self.front, self.back)
+        super().save(*args, **kwargs)
+
 # backward map to ItemTable.items
 class UserItem(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE) 
     item = models.ForeignKey(ItemTable, on_delete=models.CASCADE)
     last_seen = models.DateTimeField(auto_now_add=True)
     score = models.PositiveSmallIntegerField(default=0)
+    due_at = models.DateTimeField(default=timezone.now) # materialized from score/last_seen, keep in sync with refresh_due_at
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'due_at'], name='useritem_user_due_at'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'item'], name='useritem_user_item_unique'), # one score per card, and the study anti-join
+        ]
+
+    def refresh_due_at(self):
+        self.due_at = get_scheduler().due_at(self.score, self.last_seen)
 
 # backward map to CollectionTable.collections
 class TopicTable(models.Model):
@@ -34,11 +115,23 @@ class TopicTable(models.Model):
     #multimode = models.CharField(max_length=10)
     items = models.ManyToManyField(ItemTable, through='TopicItem', blank=True, related_name='topics')
 
+    objects = VisibilityQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'visibility'], name='topic_user_visibility'), # browsing someone's shared topics
+        ]
+
 class TopicItem(models.Model):
     topic = models.ForeignKey(TopicTable, on_delete=models.CASCADE)
     item = models.ForeignKey(ItemTable, on_delete=models.CASCADE)
     genre = models.PositiveSmallIntegerField(default=0)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['topic', 'item'], name='topicitem_topic_item_unique'), # a card is in a topic once, topic -> items
+        ]
+
 class CollectionTable(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     collection_name = models.CharField(max_length=50)
@@ -47,8 +140,102 @@ class CollectionTable(models.Model):
     #visibility_last_change = models.CharField(max_length=30) # to stop constant switching, time consuming operation, maybe not necessary
     topics = models.ManyToManyField(TopicTable, through='CollectionTopic', blank=True, related_name='collections')
 
+    objects = VisibilityQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'visibility'], name='collection_user_visibility'), # browsing someone's shared collections
+        ]
+
 class CollectionTopic(models.Model):
     collection = models.ForeignKey(CollectionTable, related_name='collectiontopic_set', on_delete=models.CASCADE)
     topic = models.ForeignKey(TopicTable, on_delete=models.PROTECT)
     is_active = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['collection', 'topic'], condition=Q(is_active=True), name='collectiontopic_active'), # the study chain
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['collection', 'topic'], name='collectiontopic_collection_topic_unique'),
+        ]
+
+
+# append only history of reviews, one row per reviewed card, written in bulk through review_log.py
+class ReviewLog(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    item = models.ForeignKey(ItemTable, null=True, on_delete=models.SET_NULL) # keep the history when the card goes
+    increment = models.SmallIntegerField()
+    score_before = models.PositiveSmallIntegerField()
+    score_after = models.PositiveSmallIntegerField()
+    last_seen_before = models.DateTimeField()
+    reviewed_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'reviewed_at'], name='reviewlog_user_reviewed_at'),
+        ]
+
+# change sequence behind sync/, one row per changed object, the id is the client's cursor.
+# A row only says what changed and whose data it belongs to (plain ids, they outlive the rows they point at),
+# sync/ reads the current state of the object and sends a tombstone if it is gone. Written through sync.py
+class ChangeLog(models.Model):
+    ITEM = 'item'
+    USER_ITEM = 'user_item'
+    TOPIC = 'topic'
+    TOPIC_ITEM = 'topic_item'
+    COLLECTION = 'collection'
+    COLLECTION_TOPIC = 'collection_topic'
+
+    kind = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    scope_user_id = models.BigIntegerField(null=True) # scores, and the user's own topics and collections
+    scope_topic_id = models.BigIntegerField(null=True) # items and memberships of a topic
+    scope_collection_id = models.BigIntegerField(null=True) # memberships of a collection
+    created_at = models.DateTimeField(default=timezone.now, db_index=True) # for the commit window and pruning, see sync.py
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['scope_user_id', 'id'], name='changelog_user_cursor'),
+            models.Index(fields=['scope_topic_id', 'id'], name='changelog_topic_cursor'),
+            models.Index(fields=['scope_collection_id', 'id'], name='changelog_collection_cursor'),
+        ]
+
+
+# database backed queue for heavy mutations, run by `manage.py run_jobs` through jobs.py.
+# Handlers work in committed chunks and redo only what is left, so a job whose worker died
+# (lease_until passed while running) is simply picked up again
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, default=QUEUED)
+    progress = models.JSONField(default=dict)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+    lease_until = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='job_status_id'),
+            models.Index(fields=['user', 'id'], name='job_user_id'),
+        ]
+
+
+# a file a job needs (an uploaded deck), in JOB_UPLOAD_CHUNK_SIZE rows: the worker may run on another machine
+# (its own dyno) than the web process that took the upload, and neither side ever holds the whole file
+class JobUpload(models.Model):
+    job = models.ForeignKey(Job, on_delete=models.CASCADE, related_name='upload_chunks')
+    seq = models.PositiveIntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['job', 'seq'], name='jobupload_job_seq')]
@@ -0,0 +1,83 @@
+# write-behind buffer for ReviewLog.
+# update_n_items_user records one event per reviewed card here instead of inserting it, and the buffer
+# is written with a single bulk_create once the response has gone out (request_finished), or earlier if
+# it reaches REVIEW_LOG_FLUSH_SIZE. So a review batch costs at most one extra INSERT per FLUSH_SIZE
+# events, none of it before the response, and get_stats() shows what the flushes actually cost.
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import request_finished
+
+from .models import ReviewLog
+
+
+REVIEW_LOG_FLUSH_SIZE = getattr(settings, 'REVIEW_LOG_FLUSH_SIZE', 500)
+
+_local = threading.local()
+_stats_lock = threading.Lock()
+_stats = {'flushes': 0, 'rows': 0, 'seconds_total': 0.0, 'seconds_max': 0.0, 'failures': 0}
+
+
+def _buffer():
+    if not hasattr(_local, 'events'):
+        _local.events = []
+    return _local.events
+
+
+def record(user_id, item_id, increment, score_before, score_after, last_seen_before, reviewed_at):
+    events = _buffer()
+    events.append(ReviewLog(
+        user_id=user_id, item_id=item_id, increment=increment,
+        score_before=score_before, score_after=score_after,
+        last_seen_before=last_seen_before, reviewed_at=reviewed_at,
+    ))
+    if len(events) >= REVIEW_LOG_FLUSH_SIZE:
+        flush()
+
+
+def pending():
+    return len(_buffer())
+
+
+def flush():
+    events = _buffer()
+    if not events:
+        return 0
+    _local.events = []
+    start = time.perf_counter()
+    try:
+        ReviewLog.objects.bulk_create(events, batch_size=REVIEW_LOG_FLUSH_SIZE)
+    except Exception as e:
+        # the history is best effort, losing it must not break studying
+        print(f'Review log flush of {len(events)} events failed: {e}')
+        with _stats_lock:
+            _stats['failures'] += 1
+        return 0
+    elapsed = time.perf_counter() - start
+    with _stats_lock:
+        _stats['flushes'] += 1
+        _stats['rows'] += len(events)
+        _stats['seconds_total'] += elapsed
+        _stats['seconds_max'] = max(_stats['seconds_max'], elapsed)
+    return len(events)
+
+
+def get_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['seconds_per_flush'] = stats['seconds_total'] / stats['flushes'] if stats['flushes'] else None
+    stats['flush_size'] = REVIEW_LOG_FLUSH_SIZE
+    return stats
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.update({'flushes': 0, 'rows': 0, 'seconds_total': 0.0, 'seconds_max': 0.0, 'failures': 0})
+
+
+def _flush_on_request_finished(sender, **kwargs):
+    flush()
+
+
+request_finished.connect(_flush_on_request_finished, dispatch_uid='review_log_flush')
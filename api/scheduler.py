@@ -0,0 +1,156 @@
+# spaced repetition scheduling, the one place that knows what a score means.
+# Views, serializers and models go through get_scheduler(), settings.STUDY_SCHEDULER picks the class,
+# so another scheduler (SM-2, FSRS, ...) only has to implement the abstract methods of Scheduler below.
+#
+# Every rule has a scalar version, for single cards, and a NumPy batch version that takes arrays of
+# scores and last_seen (as epoch seconds, see to_epoch) and does a whole deck in one call.
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+
+def to_epoch(datetimes):
+    return np.array([dt.timestamp() for dt in datetimes], dtype=np.float64)
+
+
+def from_epoch(seconds):
+    return [datetime.fromtimestamp(second, tz=dt_timezone.utc) for second in seconds.tolist()]
+
+
+class Scheduler(ABC):
+    # score the client sees for a stored score
+    @abstractmethod
+    def client_score(self, score):
+        ...
+
+    # stored score after a review, increment is 1 or -1
+    @abstractmethod
+    def next_score(self, score, increment):
+        ...
+
+    # when a card becomes eligible again, this is what gets materialized in UserItem.due_at
+    @abstractmethod
+    def due_at(self, score, last_seen):
+        ...
+
+    def is_due(self, score, last_seen, now):
+        return self.due_at(score, last_seen) <= now
+
+    # database side filters on UserItem for the older cards and the new (level 0) cards that can be studied now
+    def due_filter(self, now):
+        return Q(due_at__lte=now)
+
+    @abstractmethod
+    def new_filter(self, now):
+        ...
+
+    # batch versions, arrays in and arrays out
+    def client_scores(self, scores):
+        return np.array([self.client_score(score) for score in scores.tolist()])
+
+    def next_scores(self, scores, increments):
+        return np.array([self.next_score(score, inc) for score, inc in zip(scores.tolist(), increments.tolist())])
+
+    @abstractmethod
+    def due_ats(self, scores, last_seens):
+        ...
+
+    def due_mask(self, scores, last_seens, now):
+        return self.due_ats(scores, last_seens) <= now
+
+    # next (score, last_seen, due_at) for a batch of reviews done at now
+    def next_states(self, scores, increments, now):
+        next_scores = self.next_scores(scores, increments)
+        last_seens = np.full(next_scores.shape, now, dtype=np.float64)
+        return next_scores, last_seens, self.due_ats(next_scores, last_seens)
+
+
+# the level system we started with:
+# with 6 visible levels and 4 top score repeats we get client levels 0,1,2,3,4,4,4,4,5, stored as 0..8
+#   - below the client max: always due
+#   - B levels (client max up to retirement): due level_b after last seen, failing one drops below the client max
+#   - retired (stored max): due level_a after last seen, failing drops back to the client max
+class LevelScheduler(Scheduler):
+    def __init__(self, visible_levels=None, top_score_repeats=None, level_a=None, level_b=None):
+        visible_levels = visible_levels or settings.NUMBER_OF_VISIBLE_LEVELS
+        top_score_repeats = top_score_repeats or settings.TOP_SCORE_REPEATS
+        self.max_score_client = visible_levels - 2
+        self.max_score_backend = self.max_score_client + top_score_repeats
+        self.level_a = level_a or settings.STUDY_LEVEL_A_INTERVAL
+        self.level_b = level_b or settings.STUDY_LEVEL_B_INTERVAL
+
+    def client_score(self, score):
+        return self.max_score_client + 1 if score == self.max_score_backend else min(score, self.max_score_client)
+
+    def next_score(self, score, increment):
+        # top level:
+        if score == self.max_score_backend and increment < 0:
+            return self.max_score_client
+        # if you fail the B level
+        elif score >= self.max_score_client and increment < 0:
+            return self.max_score_client - 1
+        return min(max(0, score + increment), self.max_score_backend)
+
+    def interval(self, score):
+        if score == self.max_score_backend:
+            return self.level_a
+        elif score >= self.max_score_client:
+            return self.level_b
+        return timedelta(0)
+
+    def due_at(self, score, last_seen):
+        return last_seen + self.interval(score)
+
+    # new cards wait out the B interval too, so a card you just saw doesn't come straight back
+    def new_filter(self, now):
+        return Q(score=0, last_seen__lte=now - self.level_b)
+
+    def client_scores(self, scores):
+        return np.where(scores == self.max_score_backend, self.max_score_client + 1, np.minimum(scores, self.max_score_client))
+
+    def next_scores(self, scores, increments):
+        failed = increments < 0
+        return np.where(
+            failed & (scores == self.max_score_backend), self.max_score_client,
+            np.where(
+                failed & (scores >= self.max_score_client), self.max_score_client - 1,
+                np.clip(scores + increments, 0, self.max_score_backend),
+            ),
+        )
+
+    def intervals(self, scores):
+        return np.where(
+            scores == self.max_score_backend, self.level_a.total_seconds(),
+            np.where(scores >= self.max_score_client, self.level_b.total_seconds(), 0.0),
+        )
+
+    def due_ats(self, scores, last_seens):
+        return last_seens + self.intervals(scores)
+
+
+@lru_cache(maxsize=None)
+def get_scheduler():
+    return import_string(settings.STUDY_SCHEDULER)()
+
+
+# recompute due_at for every UserItem in the queryset with the batch path, e.g. after changing STUDY_SCHEDULER
+def recompute_due_at(user_items, chunk_size=2000):
+    from .models import UserItem
+
+    scheduler = get_scheduler()
+    updated = 0
+    rows = list(user_items.order_by('id').values_list('id', 'score', 'last_seen')[:chunk_size])
+    while rows:
+        ids, scores, last_seens = zip(*rows)
+        due_ats = from_epoch(scheduler.due_ats(np.array(scores), to_epoch(last_seens)))
+        UserItem.objects.bulk_update(
+            [UserItem(id=id, due_at=due_at) for id, due_at in zip(ids, due_ats)], ['due_at'], batch_size=chunk_size
+        )
+        updated += len(rows)
+        rows = list(user_items.filter(id__gt=ids[-1]).order_by('id').values_list('id', 'score', 'last_seen')[:chunk_size])
+    return updated
@@ -1,9 +1,11 @@
 # this page is for pulling data from the databases, which can be called by the views
 from django.contrib.auth.hashers import make_password
+from django.db.models import Count, Prefetch
 from rest_framework import serializers
 #from django.contrib.auth.models import User
 
 from .models import CustomUser,TopicTable,CollectionTable,CollectionTopic,ItemTable,UserItem,TopicItem
+from .scheduler import get_scheduler
 
 
 class CustomUserSerializer(serializers.ModelSerializer):
@@ -41,6 +43,11 @@ class ItemTableSerializer(serializers.ModelSerializer):
         model = ItemTable
         fields = ['id', 'front', 'back', 'users', 'topics']
 
+    # users and topics are a query each per item unless prefetched, use this on any list of items
+    @staticmethod
+    def setup_eager_loading(queryset, prefix=''):
+        return queryset.prefetch_related(f'{prefix}users', f'{prefix}topics')
+
 
 #class UserItemSerializer(serializers.ModelSerializer):
 #   items = ItemTableSerializer(many=True, read_only=True)
@@ -66,10 +73,7 @@ class UserItemSerializer(serializers.ModelSerializer):
 
     # takes care of the weird level property we have. 
     def get_score(self, obj):
-        MAX_SCORE_BACKEND = 8 #int(os.getenv('MAX_SCORE_BACKEND'))
-        MAX_SCORE_CLIENT = 4 #int(os.getenv('MAX_SCORE_CLIENT'))
-        score = obj.score
-        return (MAX_SCORE_CLIENT + 1 if score == MAX_SCORE_BACKEND else min(score, MAX_SCORE_CLIENT))
+        return get_scheduler().client_score(obj.score)
 
 
 
@@ -80,17 +84,28 @@ class TopicTableSerializer(serializers.ModelSerializer):
         model = TopicTable
         fields = ['id', 'user', 'topic_name', 'description', 'visibility', 'items', 'collections'] 
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return ItemTableSerializer.setup_eager_loading(queryset.prefetch_related('collections', 'items'), prefix='items__')
+
 
 class CollectionTopicSerializer(serializers.ModelSerializer):
     topic_name = serializers.SerializerMethodField()
+    item_count = serializers.SerializerMethodField()
 
     class Meta:
         model = CollectionTopic
-        fields = ['id', 'collection', 'topic', 'is_active', 'topic_name']
+        fields = ['id', 'collection', 'topic', 'is_active', 'topic_name', 'item_count']
 
     def get_topic_name(self, obj):
         return obj.topic.topic_name
 
+    # deck size, annotated by CollectionTableSerializer.setup_eager_loading, counted here otherwise
+    def get_item_count(self, obj):
+        if hasattr(obj, 'item_count'):
+            return obj.item_count
+        return obj.topic.items.count()
+
 
 
 class CollectionTableSerializer(serializers.ModelSerializer):
@@ -100,6 +115,12 @@ class CollectionTableSerializer(serializers.ModelSerializer):
         model = CollectionTable
         fields = ['id', 'user', 'collection_name', 'description', 'visibility', 'topics']
 
+    # one query for the collections, one for all their topics with names and item counts
+    @staticmethod
+    def setup_eager_loading(queryset):
+        collection_topics = CollectionTopic.objects.select_related('topic').annotate(item_count=Count('topic__topicitem'))
+        return queryset.prefetch_related(Prefetch('collectiontopic_set', queryset=collection_topics))
+
 
         
 class TopicItemSerializer(serializers.ModelSerializer):
@@ -118,14 +139,16 @@ class GetTopicTableItemSerializer(serializers.ModelSerializer):
 
     def get_score(self, obj):
         # user=self.context['request'] ,,, how we used to do it to get the user that is accessing
-        profile_user_id = self.context.get('profile_user_id')
-        user_item = UserItem.objects.filter(user_id=profile_user_id, item=obj).first()
-        MAX_SCORE_BACKEND = 8 #int(os.getenv('MAX_SCORE_BACKEND'))
-        MAX_SCORE_CLIENT = 4 #int(os.getenv('MAX_SCORE_CLIENT'))
-
-        if user_item is not None: # should not be none if using the profile
-            score = user_item.score
-            return (MAX_SCORE_CLIENT + 1 if score == MAX_SCORE_BACKEND else min(score, MAX_SCORE_CLIENT))
+        # views listing many topics pass the profile user's scores in as {item_id: score}, so we don't query per item
+        scores = self.context.get('scores')
+        if scores is not None:
+            score = scores.get(obj.id)
+        else:
+            profile_user_id = self.context.get('profile_user_id')
+            score = UserItem.objects.filter(user_id=profile_user_id, item=obj).values_list('score', flat=True).first()
+
+        if score is not None: # should not be none if using the profile
+            return get_scheduler().client_score(score)
         else:
             return 0 # showing how you have done on it, you haven't yet interacted
 
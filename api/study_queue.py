@@ -0,0 +1,129 @@
+# per (user, collection) study queue for fetch_n_from_collection, kept in django's cache.
+# The queue is built once (see views.build_study_queue) and then handed out a few cards at a time,
+# so a study session doesn't redo the collection -> active topics -> items -> eligibility chain on every fetch.
+# The level 0 side holds item ids (the user may have no UserItem for them yet), the older side UserItem ids.
+# A side the build came back short on is marked exhausted: there is nothing more to study there right now, so
+# what is left of it is served (down to nothing) instead of rebuilding the queue on every fetch of a caught up user.
+#
+# A stored queue never changes, each put() is a new generation with its own offset counters, and take() claims
+# its slice with cache.incr, so two fetches at the same time get different cards. incr is atomic on the
+# locmem, memcached and redis caches (not on the database and file ones, where a duplicate card is possible).
+#
+# Invalidation:
+#   - editing a collection's topics, or the items of a topic, bumps the collection's version, which
+#     orphans every user's queue for it (they then just expire)
+#   - reviewing cards drops only this user's queues that still have one of the reviewed cards to hand out,
+#     cards already handed out (before the offsets) don't count
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import CollectionTopic
+
+
+STUDY_QUEUE_SIZE = getattr(settings, 'STUDY_QUEUE_SIZE', 100)
+STUDY_QUEUE_TIMEOUT = getattr(settings, 'STUDY_QUEUE_TIMEOUT', 300)
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+
+def _count(stat, amount=1):
+    with _stats_lock:
+        _stats[stat] += amount
+
+
+def get_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else None
+    return stats
+
+
+def reset_stats():
+    with _stats_lock:
+        for stat in _stats:
+            _stats[stat] = 0
+
+
+def _collection_version(collection_id):
+    # a missing version (never set, or evicted) gets a fresh one, so queues stored under an old one can't come back
+    key = f'study_queue_version:{collection_id}'
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def _queue_key(user_id, collection_id):
+    return f'study_queue:{user_id}:{collection_id}:{_collection_version(collection_id)}'
+
+
+def _index_key(user_id):
+    return f'study_queue_index:{user_id}'
+
+
+def _offset_keys(key, queue):
+    return f'{key}:{queue["generation"]}:zero', f'{key}:{queue["generation"]}:old'
+
+
+# hands out n_zero level 0 ids and n_old older ids from the queue, fewer of a side that is exhausted,
+# or None (a miss) if it can't serve them
+def take(user_id, collection_id, n_zero, n_old):
+    key = _queue_key(user_id, collection_id)
+    queue = cache.get(key)
+    if queue is not None:
+        try:
+            zero_end, old_end = [cache.incr(offset_key, n) for offset_key, n in zip(_offset_keys(key, queue), (n_zero, n_old))]
+        except ValueError: # the offsets were evicted
+            queue = None
+    if queue is not None:
+        zero_ids, old_ids = queue['zero'][zero_end - n_zero:zero_end], queue['old'][old_end - n_old:old_end]
+        if (len(zero_ids) < n_zero and not queue['exhausted']['zero']) or (len(old_ids) < n_old and not queue['exhausted']['old']):
+            queue = None
+    if queue is None:
+        _count('misses')
+        return None
+    _count('hits')
+    return zero_ids, old_ids
+
+
+# exhausted is (level 0 side, older side), True where the build found fewer cards than it asked for
+def put(user_id, collection_id, zero_ids, old_ids, exhausted=(False, False)):
+    key = _queue_key(user_id, collection_id)
+    queue = {'generation': uuid.uuid4().hex, 'zero': zero_ids, 'old': old_ids, 'exhausted': dict(zip(('zero', 'old'), exhausted))}
+    cache.set_many({offset_key: 0 for offset_key in _offset_keys(key, queue)}, STUDY_QUEUE_TIMEOUT)
+    cache.set(key, queue, STUDY_QUEUE_TIMEOUT)
+    index = cache.get(_index_key(user_id)) or set()
+    if collection_id not in index:
+        cache.set(_index_key(user_id), index | {collection_id}, STUDY_QUEUE_TIMEOUT)
+
+
+def invalidate_collections(collection_ids):
+    for collection_id in set(collection_ids):
+        cache.set(f'study_queue_version:{collection_id}', uuid.uuid4().hex, None)
+        _count('invalidations')
+
+
+def invalidate_topics(topic_ids):
+    invalidate_collections(CollectionTopic.objects.filter(topic_id__in=topic_ids).values_list('collection_id', flat=True))
+
+
+# user_item_ids (with their item_ids) were just reviewed by the user
+def invalidate_reviewed(user_id, user_item_ids, item_ids):
+    index = cache.get(_index_key(user_id))
+    if not index:
+        return
+    user_item_ids, item_ids = set(user_item_ids), set(item_ids)
+    keys = [_queue_key(user_id, collection_id) for collection_id in index]
+    for key, queue in cache.get_many(keys).items():
+        zero_key, old_key = _offset_keys(key, queue)
+        offsets = cache.get_many([zero_key, old_key])
+        left_zero, left_old = queue['zero'][offsets.get(zero_key, 0):], queue['old'][offsets.get(old_key, 0):]
+        if item_ids.intersection(left_zero) or user_item_ids.intersection(left_old):
+            cache.delete(key)
+            _count('invalidations')
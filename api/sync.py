@@ -0,0 +1,192 @@
+# change tracking and delta sync for offline clients.
+# Every view that writes items, scores, topics, collections or their memberships records what it touched
+# here (bulk operations skip model signals, so this is explicit), and sync/ turns the ChangeLog rows after a
+# client's cursor into upserts and tombstones. Deletes have to be recorded before they happen, the
+# record_*_delete helpers follow the cascades. A delete is also scoped to the user owning the topic or
+# collection it happened in, so it still reaches them when that topic or collection is deleted afterwards.
+#
+# The cursor is a ChangeLog id. Ids are handed out at INSERT but only become visible at COMMIT, so on PostgreSQL a
+# transaction holding a lower id can commit after a sync has returned a higher one. Cursors only move past rows
+# older than SYNC_COMMIT_WINDOW (longer than any write transaction here), newer rows are sent but come again next
+# time. SQLite has one writer at a time, its ids become visible in order.
+#
+# prune() (manage.py prune_changelog) drops rows older than SYNC_RETENTION, a cursor from before that gets a 410
+# and the client starts over without one.
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .models import ChangeLog, ItemTable, UserItem, TopicTable, TopicItem, CollectionTable, CollectionTopic
+from .scheduler import get_scheduler
+
+
+SYNC_PAGE_SIZE = getattr(settings, 'SYNC_PAGE_SIZE', 5000)
+SYNC_COMMIT_WINDOW = getattr(settings, 'SYNC_COMMIT_WINDOW', timedelta(seconds=30))
+SYNC_RETENTION = getattr(settings, 'SYNC_RETENTION', timedelta(days=30))
+PRUNE_CHUNK_SIZE = 10000
+
+# kind -> (model, fields sent to the client, filter limiting it to what the user may get)
+SYNCED = {
+    ChangeLog.ITEM: (ItemTable, ['id', 'front', 'back'], lambda user: Q()),
+    ChangeLog.USER_ITEM: (UserItem, ['id', 'item', 'last_seen', 'score'], lambda user: Q(user=user)),
+    ChangeLog.TOPIC: (TopicTable, ['id', 'user', 'topic_name', 'description', 'visibility'], lambda user: Q(user=user)),
+    ChangeLog.TOPIC_ITEM: (TopicItem, ['id', 'topic', 'item'], lambda user: Q(topic__user=user)),
+    ChangeLog.COLLECTION: (CollectionTable, ['id', 'user', 'collection_name', 'description', 'visibility'], lambda user: Q(user=user)),
+    ChangeLog.COLLECTION_TOPIC: (CollectionTopic, ['id', 'collection', 'topic', 'is_active'], lambda user: Q(collection__user=user)),
+}
+
+
+# recording
+def record(kind, object_ids, user_id=None, topic_id=None, collection_id=None):
+    ChangeLog.objects.bulk_create([
+        ChangeLog(kind=kind, object_id=object_id, scope_user_id=user_id, scope_topic_id=topic_id, scope_collection_id=collection_id)
+        for object_id in object_ids
+    ])
+
+
+# pairs of (object_id, scope id), scope is one of 'user_id', 'topic_id', 'collection_id'
+def record_scoped(kind, pairs, scope):
+    ChangeLog.objects.bulk_create([
+        ChangeLog(kind=kind, object_id=object_id, **{f'scope_{scope}': scope_id}) for object_id, scope_id in pairs
+    ])
+
+
+# items changed in place, every topic holding them hears about it
+def record_items(item_ids):
+    record_scoped(ChangeLog.ITEM, TopicItem.objects.filter(item_id__in=item_ids).values_list('item_id', 'topic_id'), 'topic_id')
+
+
+# (object_id, scope id, owner id) rows for deletes, scope is 'topic_id' or 'collection_id'
+def record_deletes(kind, rows, scope):
+    ChangeLog.objects.bulk_create([
+        ChangeLog(kind=kind, object_id=object_id, scope_user_id=owner_id, **{f'scope_{scope}': scope_id}) for object_id, scope_id, owner_id in rows
+    ])
+
+
+def record_item_deletes(item_ids):
+    topic_items = list(TopicItem.objects.filter(item_id__in=item_ids).values_list('id', 'item_id', 'topic_id', 'topic__user_id'))
+    record_deletes(ChangeLog.ITEM, [(item_id, topic_id, owner_id) for _, item_id, topic_id, owner_id in topic_items], 'topic_id')
+    record_deletes(ChangeLog.TOPIC_ITEM, [(id, topic_id, owner_id) for id, _, topic_id, owner_id in topic_items], 'topic_id')
+    user_items = list(UserItem.objects.filter(item_id__in=item_ids).values_list('id', 'item_id', 'user_id'))
+    record_scoped(ChangeLog.USER_ITEM, [(id, user_id) for id, _, user_id in user_items], 'user_id')
+    # whoever studies the card from somebody else's topic has it in their full_state, and loses it now
+    record_scoped(ChangeLog.ITEM, [(item_id, user_id) for _, item_id, user_id in user_items], 'user_id')
+
+
+def record_collection_topic_deletes(collection_topics):
+    record_deletes(ChangeLog.COLLECTION_TOPIC, collection_topics.values_list('id', 'collection_id', 'collection__user_id'), 'collection_id')
+
+
+def record_topic_delete(topic):
+    record(ChangeLog.TOPIC, [topic.id], user_id=topic.user_id)
+    record(ChangeLog.TOPIC_ITEM, TopicItem.objects.filter(topic=topic).values_list('id', flat=True), user_id=topic.user_id, topic_id=topic.id)
+    record_collection_topic_deletes(CollectionTopic.objects.filter(topic=topic))
+
+
+def record_collection_delete(collection):
+    record(ChangeLog.COLLECTION, [collection.id], user_id=collection.user_id)
+    record(ChangeLog.COLLECTION_TOPIC, collection.collectiontopic_set.values_list('id', flat=True), user_id=collection.user_id, collection_id=collection.id)
+
+
+# for views that rework a collection's topics: snapshot before, then record whatever differs afterwards
+def collection_topics_snapshot(collection_id):
+    return dict(CollectionTopic.objects.filter(collection_id=collection_id).values_list('id', 'is_active'))
+
+
+def record_collection_topics_diff(collection_id, before):
+    after = collection_topics_snapshot(collection_id)
+    changed = [id for id in before.keys() | after.keys() if before.get(id) != after.get(id)]
+    record(ChangeLog.COLLECTION_TOPIC, changed, collection_id=collection_id)
+
+
+# reading
+def commit_window():
+    return timedelta(0) if connection.vendor == 'sqlite' else SYNC_COMMIT_WINDOW
+
+
+# the newest id every earlier write has certainly committed by
+def current_cursor():
+    return ChangeLog.objects.filter(created_at__lte=timezone.now() - commit_window()).aggregate(cursor=Max('id'))['cursor'] or 0
+
+
+# the changes after cursor have been pruned (or some of them), only a full sync can catch the client up
+def cursor_too_old(cursor):
+    oldest = ChangeLog.objects.order_by('id').values_list('id', flat=True).first()
+    return oldest is not None and cursor + 1 < oldest
+
+
+def _rows(kind, user, filter):
+    model, fields, permitted = SYNCED[kind]
+    rows = list(model.objects.filter(filter & permitted(user)).values(*fields))
+    if kind == ChangeLog.USER_ITEM:
+        scheduler = get_scheduler()
+        for row in rows:
+            row['score'] = scheduler.client_score(row['score'])
+    return rows
+
+
+# everything of the user's own, for a client without a cursor
+def full_state(user):
+    cursor = current_cursor() # taken first, anything written while we read gets sent again next time
+    topic_ids = TopicTable.objects.filter(user=user).values('id')
+    item_ids = TopicItem.objects.filter(topic_id__in=topic_ids).values('item_id')
+    data = {
+        'items': _rows(ChangeLog.ITEM, user, Q(id__in=item_ids) | Q(id__in=UserItem.objects.filter(user=user).values('item_id'))),
+        'user_items': _rows(ChangeLog.USER_ITEM, user, Q()),
+        'topics': _rows(ChangeLog.TOPIC, user, Q()),
+        'topic_items': _rows(ChangeLog.TOPIC_ITEM, user, Q()),
+        'collections': _rows(ChangeLog.COLLECTION, user, Q()),
+        'collection_topics': _rows(ChangeLog.COLLECTION_TOPIC, user, Q()),
+    }
+    return {'cursor': cursor, 'full': True, 'has_more': False, **data, 'deleted': {}}
+
+
+# what changed for the user after cursor, at most SYNC_PAGE_SIZE changes at a time
+def changes_since(user, cursor, page_size=SYNC_PAGE_SIZE):
+    scope = (
+        Q(scope_user_id=user.id) |
+        Q(scope_topic_id__in=TopicTable.objects.filter(user=user).values('id')) |
+        Q(scope_collection_id__in=CollectionTable.objects.filter(user=user).values('id')) |
+        # cards of other people's topics the user studies are in their full_state, so their edits are sent too
+        Q(kind=ChangeLog.ITEM, object_id__in=UserItem.objects.filter(user=user).values('item_id'))
+    )
+    changes = list(ChangeLog.objects.filter(scope, id__gt=cursor).order_by('id').values_list('id', 'kind', 'object_id', 'created_at')[:page_size + 1])
+    has_more = len(changes) > page_size
+    changes = changes[:page_size]
+
+    # the cursor stops before the first row that may still have uncommitted ones below it, and so does paging
+    settled = timezone.now() - commit_window()
+    next_cursor = cursor
+    for id, _, _, created_at in changes:
+        if created_at > settled:
+            has_more = False
+            break
+        next_cursor = id
+
+    changed_ids = {kind: set() for kind in SYNCED}
+    for _, kind, object_id, _ in changes:
+        changed_ids[kind].add(object_id)
+
+    data = {'cursor': next_cursor, 'full': False, 'has_more': has_more, 'deleted': {}}
+    for kind, ids in changed_ids.items():
+        rows = _rows(kind, user, Q(id__in=ids)) if ids else []
+        data[kind + 's'] = rows
+        data['deleted'][kind + 's'] = sorted(ids - {row['id'] for row in rows})
+    return data
+
+
+# drop the rows older than retention, in chunks, always keeping the newest row so cursor_too_old has something to go by.
+# Returns how many were dropped
+def prune(retention=SYNC_RETENTION):
+    newest = ChangeLog.objects.aggregate(newest=Max('id'))['newest']
+    last = ChangeLog.objects.filter(created_at__lt=timezone.now() - retention, id__lt=newest or 0).aggregate(last=Max('id'))['last']
+    pruned = 0
+    while last is not None:
+        ids = list(ChangeLog.objects.filter(id__lte=last).order_by('id').values_list('id', flat=True)[:PRUNE_CHUNK_SIZE])
+        if not ids:
+            break
+        pruned += ChangeLog.objects.filter(id__in=ids).delete()[0]
+    return pruned
@@ -1,11 +1,31 @@
-from django.test import TestCase
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.conf import settings
 from rest_framework.test import APIClient
 from django.contrib.auth import get_user_model
 from django.urls import reverse
-from .models import CollectionTable, TopicTable, ItemTable, UserItem, CustomUser
+from django.core.cache import cache
+from django.db import connection, connections
+from django.db.models import Exists, OuterRef
+from django.test.utils import CaptureQueriesContext
+from . import study_queue, review_log, jobs, importer, views, db, sync
+from .models import CollectionTable, TopicTable, ItemTable, UserItem, CustomUser, ReviewLog, TopicItem, CollectionTopic, Job, JobUpload, ChangeLog, content_hash
+from .serializers import UserItemSerializer, ItemTableSerializer
+from . import fast_serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from .scheduler import Scheduler, LevelScheduler, get_scheduler, to_epoch
 import json
 from urllib.parse import urlencode
 import time  
+import io
+import os
+import tempfile
+import sqlite3
+from unittest import mock, skipUnless
+from django.core.management import call_command
+import numpy as np
+from datetime import timedelta
+from django.utils import timezone
 
 def print_success(testname):
     print('==============================================')
@@ -15,6 +35,9 @@ def print_success(testname):
 class FlashcardsTestCase(TestCase):
     def setUp(self):
         self.client = APIClient()
+        cache.clear()
+        study_queue.reset_stats()
+        review_log.reset_stats()
 
         self.user1 = CustomUser.objects.create_user(
             username="user1",
@@ -330,3 +353,920 @@ class FlashcardsTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         print_success("tokens")
 
+
+    # 8. (STUDY ELIGIBILITY) register user, make one topic in a collection, put items at each level with different last_seen,
+    # and check that fetch only returns the ones that are due, most overdue first
+    def test_fetch_eligibility(self):
+        print("Testing fetch eligibility...")
+        self.login_user_for_tests('user1', 'password')
+
+        response = self.json_post_req('create_collection', {'collection_name': 'Collection1'})
+        collection_id = response.json()['id']
+        response = self.json_post_req('create_topic', {'topic_name': 'Topic1'})
+        topic_id = response.json()['id']
+        self.json_post_req('edit_topics_in_collection', {'collection_id': collection_id, 'topic_edits': [[topic_id, 'add']]})
+
+        # (score, minutes since last seen, should be returned)
+        now = timezone.now()
+        cases = [
+            (8, 60 * 24 * 8, True), (8, 60, False),  # retired level
+            (5, 31, True), (5, 10, False),           # B levels
+            (2, 3, True), (3, 2000, True),           # below client max
+        ]
+        self.json_post_req('add_items_to_topic', {'topic_id': topic_id, 'items': [[f'front{i}', f'back{i}'] for i in range(len(cases))]})
+        user_items = list(UserItem.objects.filter(user=self.user1).order_by('id'))
+        due_ats = []
+        for user_item, (score, minutes, _) in zip(user_items, cases):
+            last_seen = now - timedelta(minutes=minutes)
+            due_ats.append(get_scheduler().due_at(score, last_seen))
+            UserItem.objects.filter(id=user_item.id).update(score=score, last_seen=last_seen, due_at=due_ats[-1])
+        expected = [ui.id for ui, due_at, (_, _, due) in sorted(zip(user_items, due_ats, cases), key=lambda c: c[1]) if due]
+
+        response = self.json_get_req('fetch_n_from_collection', {'collection_id': collection_id, 'n_old': 10, 'n_zero': 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json()], expected)
+
+        # limit is applied in the query, most overdue first (on a fresh build, the first fetch left an exhausted queue behind)
+        study_queue.invalidate_collections([collection_id])
+        response = self.json_get_req('fetch_n_from_collection', {'collection_id': collection_id, 'n_old': 2, 'n_zero': 0})
+        self.assertEqual([item['id'] for item in response.json()], expected[:2])
+        print_success("fetch eligibility")
+
+    # 9. (BATCH UPDATE) register two users, check the score transitions of one batch, and that a foreign or unknown id
+    # is reported without stopping the rest of the batch
+    def test_update_batch(self):
+        print("Testing batch update...")
+        self.login_user_for_tests('user1', 'password')
+        response = self.json_post_req('create_topic', {'topic_name': 'Topic1'})
+        topic_id = response.json()['id']
+        self.json_post_req('add_items_to_topic', {'topic_id': topic_id, 'items': [[f'front{i}', f'back{i}'] for i in range(4)]})
+        user_items = list(UserItem.objects.filter(user=self.user1).order_by('id'))
+        for user_item, score in zip(user_items, [8, 6, 2, 8]):
+            UserItem.objects.filter(id=user_item.id).update(score=score)
+        foreign = UserItem.objects.create(user=self.user2, item=user_items[0].item)
+
+        items_data = [
+            {'item_id': user_items[0].id, 'increment': -1},  # top level drop
+            {'item_id': user_items[1].id, 'increment': -1},  # B level failure
+            {'item_id': user_items[2].id, 'increment': 5},   # clamped increment
+            {'item_id': user_items[3].id, 'increment': 1},   # stays at the top
+            {'item_id': foreign.id, 'increment': 1},
+            {'item_id': 999999, 'increment': 1},
+        ]
+        response = self.json_post_req('update_n_items_user', {'items': items_data})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['updated'], 4)
+        self.assertEqual([e['item_id'] for e in response.json()['errors']], [foreign.id, 999999])
+        scores = list(UserItem.objects.filter(user=self.user1).order_by('id').values_list('score', flat=True))
+        self.assertEqual(scores, [4, 3, 3, 8])
+        self.assertEqual(UserItem.objects.get(id=foreign.id).score, 0)
+        print_success("batch update")
+
+    # 10. (NEW CARD SAMPLING) register user, add new items to a collection, check that we get exactly n_zero of them back,
+    # that a seed reproduces the sample, and that just-seen level 0 items are left out
+    def test_sample_new_items(self):
+        print("Testing new card sampling...")
+        self.login_user_for_tests('user1', 'password')
+        response = self.json_post_req('create_collection', {'collection_name': 'Collection1'})
+        collection_id = response.json()['id']
+        response = self.json_post_req('create_topic', {'topic_name': 'Topic1'})
+        topic_id = response.json()['id']
+        self.json_post_req('edit_topics_in_collection', {'collection_id': collection_id, 'topic_edits': [[topic_id, 'add']]})
+        self.json_post_req('add_items_to_topic', {'topic_id': topic_id, 'items': [[f'front{i}', f'back{i}'] for i in range(30)]})
+        UserItem.objects.filter(user=self.user1).update(last_seen=timezone.now() - timedelta(hours=1))
+        just_seen = UserItem.objects.filter(user=self.user1).order_by('id')[:10]
+        UserItem.objects.filter(id__in=[ui.id for ui in just_seen]).update(last_seen=timezone.now())
+
+        params = {'collection_id': collection_id, 'n_old': 0, 'n_zero': 15, 'seed': 'abc'}
+        first = [item['id'] for item in self.json_get_req('fetch_n_from_collection', params).json()]
+        second = [item['id'] for item in self.json_get_req('fetch_n_from_collection', params).json()]
+        self.assertEqual(len(first), 15)
+        self.assertEqual(len(set(first)), 15)
+        self.assertEqual(first, second)
+        self.assertFalse(set(first) & {ui.id for ui in just_seen})
+
+        # more than there are eligible gives all of them
+        params['n_zero'] = 50
+        response = self.json_get_req('fetch_n_from_collection', params)
+        self.assertEqual(len(response.json()), 20)
+        print_success("new card sampling")
+
+    # 11. (STUDY QUEUE) register user, fetch twice from a collection and check the second one is served from the queue,
+    # then check that reviewing a queued card and adding items to the topic both invalidate it
+    def test_study_queue(self):
+        print("Testing study queue...")
+        self.login_user_for_tests('user1', 'password')
+        response = self.json_post_req('create_collection', {'collection_name': 'Collection1'})
+        collection_id = response.json()['id']
+        response = self.json_post_req('create_topic', {'topic_name': 'Topic1'})
+        topic_id = response.json()['id']
+        self.json_post_req('edit_topics_in_collection', {'collection_id': collection_id, 'topic_edits': [[topic_id, 'add']]})
+        self.json_post_req('add_items_to_topic', {'topic_id': topic_id, 'items': [[f'front{i}', f'back{i}'] for i in range(10)]})
+        UserItem.objects.filter(user=self.user1).update(score=1)
+
+        params = {'collection_id': collection_id, 'n_old': 3, 'n_zero': 0}
+        first = [item['id'] for item in self.json_get_req('fetch_n_from_collection', params).json()]
+        second = [item['id'] for item in self.json_get_req('fetch_n_from_collection', params).json()]
+        self.assertEqual(study_queue.get_stats()['misses'], 1)
+        self.assertEqual(study_queue.get_stats()['hits'], 1)
+        self.assertEqual(len(set(first + second)), 6)
+
+        # reviewing cards that were handed out leaves the queue alone
+        self.json_post_req('update_n_items_user', {'items': [{'item_id': id, 'increment': 1} for id in first]})
+        third = [item['id'] for item in self.json_get_req('fetch_n_from_collection', params).json()]
+        self.assertEqual(study_queue.get_stats()['hits'], 2)
+
+        # reviewing a card that is still queued drops the queue
+        queued = UserItem.objects.filter(user=self.user1).exclude(id__in=first + second + third).get()
+        self.json_post_req('update_n_items_user', {'items': [{'item_id': queued.id, 'increment': 1}]})
+        self.json_get_req('fetch_n_from_collection', params)
+        self.assertEqual(study_queue.get_stats()['misses'], 2)
+
+        # editing the topic drops it too
+        self.json_post_req('add_items_to_topic', {'topic_id': topic_id, 'items': [['new front', 'new back']]})
+        self.json_get_req('fetch_n_from_collection', params)
+        self.assertEqual(study_queue.get_stats()['misses'], 3)
+
+        # a caught up user is served what is left rather than rebuilding on every fetch
+        study_queue.reset_stats()
+        UserItem.objects.filter(user=self.user1).update(due_at=timezone.now() + timedelta(days=1))
+        UserItem.objects.filter(id=first[0]).update(due_at=timezone.now())
+        study_queue.invalidate_collections([collection_id])
+        responses = [self.json_get_req('fetch_n_from_collection', params).json() for _ in range(3)]
+        self.assertEqual([len(response) for response in responses], [1, 0, 0])
+        self.assertEqual((study_queue.get_stats()['misses'], study_queue.get_stats()['hits']), (1, 2))
+
+        # two takes from the same queue never hand out the same card
+        study_queue.put(self.user1.id, collection_id, [], list(range(10)))
+        taken = [study_queue.take(self.user1.id, collection_id, 0, 4)[1] for _ in range(2)]
+        self.assertEqual(taken, [[0, 1, 2, 3], [4, 5, 6, 7]])
+        self.assertIsNone(study_queue.take(self.user1.id, collection_id, 0, 4))
+        print_success("study queue")
+
+    # 12. (RESCHEDULING) recomputing due_at for a whole deck with the batch path gives what the per card path would
+    def test_recompute_due_at(self):
+        print("Testing rescheduling...")
+        self.login_user_for_tests('user1', 'password')
+        response = self.json_post_req('create_topic', {'topic_name': 'Topic1'})
+        self.json_post_req('add_items_to_topic', {'topic_id': response.json()['id'], 'items': [[f'front{i}', f'back{i}'] for i in range(9)]})
+        for score, user_item in enumerate(UserItem.objects.filter(user=self.user1).order_by('id')):
+            UserItem.objects.filter(id=user_item.id).update(score=score, due_at=timezone.now() + timedelta(days=100))
+
+        call_command('recompute_due_at', '--chunk-size', '4', stdout=io.StringIO())
+        for user_item in UserItem.objects.filter(user=self.user1):
+            self.assertEqual(user_item.due_at, get_scheduler().due_at(user_item.score, user_item.last_seen))
+        print_success("rescheduling")
+
+    # 13. (REVIEW LOG) reviews end up in the log, written with one insert per request whatever the batch size
+    def test_review_log(self):
+        print("Testing review log...")
+        self.login_user_for_tests('user1', 'password')
+        response = self.json_post_req('create_topic', {'topic_name': 'Topic1'})
+        self.json_post_req('add_items_to_topic', {'topic_id': response.json()['id'], 'items': [[f'front{i}', f'back{i}'] for i in range(12)]})
+        ids = list(UserItem.objects.filter(user=self.user1).order_by('id').values_list('id', flat=True))
+
+        def review(batch):
+            with CaptureQueriesContext(connection) as queries:
+                self.json_post_req('update_n_items_user', {'items': [{'item_id': id, 'increment': 1} for id in batch]})
+            return [q['sql'] for q in queries if 'api_reviewlog' in q['sql']]
+
+        self.assertEqual(len(review(ids[:2])), 1)
+        self.assertEqual(len(review(ids[2:])), 1)
+        self.assertEqual(review_log.pending(), 0)
+        self.assertEqual(ReviewLog.objects.filter(user=self.user1).count(), 12)
+        self.assertEqual(set(ReviewLog.objects.values_list('score_before', 'score_after')), {(0, 1)})
+        self.assertEqual(review_log.get_stats()['flushes'], 2)
+        print_success("review log")
+
+    # 14. (SYNC) full sync, then edit a deck, study, and regroup the collection, and check the delta only has those changes
+    def test_sync(self):
+        print("Testing sync...")
+        self.login_user_for_tests('user1', 'password')
+        response = self.json_post_req('create_collection', {'collection_name': 'Collection1'})
+        collection_id = response.json()['id']
+        response = self.json_post_req('create_topic', {'topic_name': 'Topic1'})
+        topic_id = response.json()['id']
+        self.json_post_req('edit_topics_in_collection', {'collection_id': collection_id, 'topic_edits': [[topic_id, 'add']]})
+        self.json_post_req('add_items_to_topic', {'topic_id': topic_id, 'items': [[f'front{i}', f'back{i}'] for i in range(3)]})
+
+        response = self.json_get_req('sync')
+        self.assertEqual(response.status_code, 200)
+        full = response.json()
+        self.assertTrue(full['full'])
+        self.assertEqual(len(full['items']), 3)
+        self.assertEqual(len(full['user_items']), 3)
+        self.assertEqual(len(full['collection_topics']), 1)
+
+        # nothing changed, nothing sent
+        delta = self.json_get_req('sync', {'cursor': full['cursor']}).json()
+        self.assertEqual(delta['cursor'], full['cursor'])
+        self.assertEqual(delta['items'], [])
+
+        items = sorted(full['items'], key=lambda item: item['id'])
+        final_items = [{'id': items[0]['id'], 'front': 'edited', 'back': 'back0'}, {'id': items[1]['id'], 'front': 'front1', 'back': 'back1'},
+                       {'id': -1, 'front': 'new', 'back': 'card'}]
+        self.json_post_req('edit_items_in_topic_full', {'topic_id': topic_id, 'items': final_items})
+        user_item = UserItem.objects.get(user=self.user1, item_id=items[1]['id'])
+        self.json_post_req('update_n_items_user', {'items': [{'item_id': user_item.id, 'increment': 1}]})
+        self.json_post_req('edit_topics_in_collection', {'collection_id': collection_id, 'topic_edits': [[topic_id, 'update']]})
+
+        delta = self.json_get_req('sync', {'cursor': full['cursor']}).json()
+        self.assertFalse(delta['full'])
+        self.assertEqual({item['front'] for item in delta['items']}, {'edited', 'new'})
+        self.assertEqual(delta['deleted']['items'], [items[2]['id']])
+        self.assertEqual(len(delta['deleted']['user_items']), 1)
+        self.assertEqual(len(delta['deleted']['topic_items']), 1)
+        self.assertEqual([ui['score'] for ui in delta['user_items'] if ui['id'] == user_item.id], [1])
+        self.assertEqual([ct['is_active'] for ct in delta['collection_topics']], [False])
+
+        # other users don't see any of it
+        self.login_user_for_tests('user2', 'password')
+        delta = self.json_get_req('sync', {'cursor': 0}).json()
+        self.assertEqual(delta['items'], [])
+        self.assertEqual(delta['deleted']['items'], [])
+
+        # cards of a shared topic the other user studies follow the owner's edits and deletes
+        TopicTable.objects.filter(id=topic_id).update(visibility='global_view')
+        shared = TopicItem.objects.filter(topic_id=topic_id).order_by('item_id').values_list('item_id', flat=True)
+        edited_id, deleted_id = shared[0], shared[1]
+        UserItem.objects.bulk_create([UserItem(user=self.user2, item_id=item_id) for item_id in (edited_id, deleted_id)])
+        cursor = self.json_get_req('sync').json()['cursor']
+        self.login_user_for_tests('user1', 'password')
+        kept = ItemTable.objects.filter(id__in=shared).exclude(id=deleted_id).values('id', 'front', 'back')
+        self.json_post_req('edit_items_in_topic_full', {'topic_id': topic_id, 'items': [
+            {**item, 'front': 'edited again'} if item['id'] == edited_id else item for item in kept
+        ]})
+        self.login_user_for_tests('user2', 'password')
+        delta = self.json_get_req('sync', {'cursor': cursor}).json()
+        self.assertEqual([item['front'] for item in delta['items']], ['edited again'])
+        self.assertEqual(delta['deleted']['items'], [deleted_id])
+
+        # deleting the topic still sends the deletes of its cards, and of the collection's topics when that goes too
+        self.login_user_for_tests('user1', 'password')
+        cursor = self.json_get_req('sync', {'cursor': delta['cursor']}).json()['cursor']
+        topic_item_ids = list(TopicItem.objects.filter(topic_id=topic_id).values_list('id', flat=True))
+        collection_topic_ids = list(CollectionTopic.objects.filter(collection_id=collection_id).values_list('id', flat=True))
+        self.json_post_req('delete_topic', {'topic_id': topic_id})
+        self.json_post_req('delete_collection', {'collection_id': collection_id})
+        delta = self.json_get_req('sync', {'cursor': cursor}).json()
+        self.assertEqual(sorted(delta['deleted']['topic_items']), sorted(topic_item_ids))
+        self.assertEqual(delta['deleted']['collection_topics'], collection_topic_ids)
+        self.assertEqual((delta['deleted']['topics'], delta['deleted']['collections']), ([topic_id], [collection_id]))
+
+        # the cursor doesn't move past changes that may have uncommitted ones below them
+        cursor = delta['cursor']
+        self.json_post_req('create_topic', {'topic_name': 'Fresh'})
+        with mock.patch.object(sync, 'commit_window', return_value=timedelta(seconds=30)):
+            delta = self.json_get_req('sync', {'cursor': cursor}).json()
+            self.assertEqual(([topic['topic_name'] for topic in delta['topics']], delta['cursor'], delta['has_more']), (['Fresh'], cursor, False))
+            ChangeLog.objects.update(created_at=timezone.now() - timedelta(minutes=1))
+            self.assertGreater(self.json_get_req('sync', {'cursor': cursor}).json()['cursor'], cursor)
+
+        # pruned history sends the client back to a full sync
+        ChangeLog.objects.update(created_at=timezone.now() - timedelta(days=31))
+        call_command('prune_changelog', stdout=io.StringIO())
+        self.assertEqual(ChangeLog.objects.count(), 1)
+        response = self.json_get_req('sync', {'cursor': full['cursor']})
+        self.assertEqual((response.status_code, response.json()['resync']), (410, True))
+        self.assertEqual(self.json_get_req('sync', {'cursor': cursor}).status_code, 200) # nothing it needed was pruned
+        print_success("sync")
+
+    # 15. (TOPIC LIST QUERIES) get_all_topics costs the same number of queries for 1 topic of 2 items as for 3 topics of 20
+    def test_get_all_topics_queries(self):
+        print("Testing get_all_topics queries...")
+        self.login_user_for_tests('user1', 'password')
+
+        def add_topic(n_items):
+            topic_id = self.json_post_req('create_topic', {'topic_name': 'Topic'}).json()['id']
+            self.json_post_req('add_items_to_topic', {'topic_id': topic_id, 'items': [[f'front{i}', f'back{i}'] for i in range(n_items)]})
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.url_get_req('get_all_topics')
+            self.assertEqual(response.status_code, 200)
+            return len(queries), response.json()
+
+        add_topic(2)
+        small, _ = count_queries()
+        add_topic(20)
+        add_topic(20)
+        UserItem.objects.filter(user=self.user1).update(score=8)
+        large, data = count_queries()
+        self.assertEqual(small, large)
+        self.assertEqual({item['score'] for topic in data for item in topic['items']}, {5})
+        print_success("get_all_topics queries")
+
+    # 16. (TOPIC ITEM QUERIES) get_topic_items and edit_topic_info take a fixed number of queries whatever the topic size
+    def test_topic_items_queries(self):
+        print("Testing topic item queries...")
+        self.login_user_for_tests('user1', 'password')
+        small = self.json_post_req('create_topic', {'topic_name': 'Small'}).json()['id']
+        self.json_post_req('add_items_to_topic', {'topic_id': small, 'items': [['front', 'back']]})
+        large = self.json_post_req('create_topic', {'topic_name': 'Large'}).json()['id']
+        self.json_post_req('add_items_to_topic', {'topic_id': large, 'items': [[f'front{i}', f'back{i}'] for i in range(40)]})
+
+        for topic_id, n_items in [(small, 1), (large, 40)]:
+            # topic, topic items, their users, their topics (request.user comes from the token)
+            with self.assertNumQueries(4):
+                response = self.url_get_req('get_topic_items', {'topic_id': topic_id})
+            self.assertEqual(len(response.json()['items']), n_items)
+
+            # topic, items, their users, their topics, collections, update, change log
+            with self.assertNumQueries(7):
+                response = self.json_post_req('edit_topic_info', {'topic_id': topic_id, 'edits': {'description': 'new'}})
+            self.assertEqual(len(response.json()['items']), n_items)
+        print_success("topic item queries")
+
+    # 17. (COLLECTION LIST QUERIES) get_all_collections is three queries whatever the number of collections and topics,
+    # and every topic comes with its item count
+    def test_get_all_collections_queries(self):
+        print("Testing get_all_collections queries...")
+        self.login_user_for_tests('user1', 'password')
+        for i in range(3):
+            collection_id = self.json_post_req('create_collection', {'collection_name': f'Collection{i}'}).json()['id']
+            for j in range(i + 1):
+                topic_id = self.json_post_req('create_topic', {'topic_name': f'Topic{i}{j}'}).json()['id']
+                self.json_post_req('add_items_to_topic', {'topic_id': topic_id, 'items': [['front', 'back']] * j})
+                self.json_post_req('edit_topics_in_collection', {'collection_id': collection_id, 'topic_edits': [[topic_id, 'add']]})
+
+        # collections, their topics with names and counts
+        with self.assertNumQueries(2):
+            response = self.url_get_req('get_all_collections')
+        self.assertEqual(len(response.json()), 3)
+        self.assertEqual([[t['item_count'] for t in c['topics']] for c in response.json()], [[0], [0, 1], [0, 1, 2]])
+        print_success("get_all_collections queries")
+
+    # 18. (BULK ADD) add_items_to_topic writes a batch in a fixed number of queries, returns the new ids,
+    # and writes nothing when any item in the batch is invalid
+    def test_add_items_bulk(self):
+        print("Testing bulk add_items_to_topic...")
+        self.login_user_for_tests('user1', 'password')
+        topic_id = self.json_post_req('create_topic', {'topic_name': 'Topic'}).json()['id']
+
+        with CaptureQueriesContext(connection) as small:
+            response = self.json_post_req('add_items_to_topic', {'topic_id': topic_id, 'items': [['front0', 'back0'], [' ', 'blank'], ['front1', 'back1']]})
+        item_ids = response.json()['item_ids']
+        self.assertEqual(item_ids[1], None)
+        self.assertEqual(list(ItemTable.objects.filter(id__in=item_ids).order_by('id').values_list('front', flat=True)), ['front0', 'front1'])
+        with CaptureQueriesContext(connection) as large:
+            response = self.json_post_req('add_items_to_topic', {'topic_id': topic_id, 'items': [[f'front{i}', f'back{i}'] for i in range(2, 150)]})
+        self.assertEqual(len(large), len(small))
+        self.assertEqual(UserItem.objects.filter(user__username='user1').count(), 150)
+
+        response = self.json_post_req('add_items_to_topic', {'topic_id': topic_id, 'items': [['ok', 'ok'], ['x' * 201, 'too long']]})
+        self.assertEqual(response.status_code, 400)
+        response = self.json_post_req('add_items_to_topic', {'topic_id': topic_id, 'items': [['ok', 'ok'], ['only front']]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(TopicItem.objects.filter(topic_id=topic_id).count(), 150)
+        print_success("bulk add_items_to_topic")
+
+    # 19. (FULL TOPIC SAVE) edit_items_in_topic_full only writes what changed, in a fixed number of queries,
+    # and can't touch items of other topics
+    def test_edit_items_full_diff(self):
+        print("Testing edit_items_in_topic_full diff...")
+        self.login_user_for_tests('user1', 'password')
+        other_topic_id = self.json_post_req('create_topic', {'topic_name': 'Other'}).json()['id']
+        other_id = self.json_post_req('add_items_to_topic', {'topic_id': other_topic_id, 'items': [['other', 'other']]}).json()['item_ids'][0]
+        topic_id = self.json_post_req('create_topic', {'topic_name': 'Topic'}).json()['id']
+        ids = self.json_post_req('add_items_to_topic', {'topic_id': topic_id, 'items': [[f'front{i}', f'back{i}'] for i in range(60)]}).json()['item_ids']
+
+        cards = list(enumerate(ids))
+
+        # keeps cards[dropped:], editing the fronts of the first edited cards, and adds added new ones
+        def save(edited, dropped, added):
+            final_items = [{'id': id, 'front': 'edited' if i < edited else f'front{i}', 'back': f'back{i}'} for i, id in cards[dropped:]]
+            final_items += [{'id': -1, 'front': 'new', 'back': 'new'}] * added + [{'id': other_id, 'front': 'hijacked', 'back': 'hijacked'}]
+            return self.json_post_req('edit_items_in_topic_full', {'topic_id': topic_id, 'items': final_items})
+
+        with CaptureQueriesContext(connection) as small:
+            response = save(edited=2, dropped=1, added=1)
+        self.assertEqual(response.json(), {'status': 'success', 'added': 1, 'updated': 1, 'unchanged': 58, 'deleted': 1})
+        cards = cards[1:]
+        # card 1 was already edited, and the new card from the first save isn't sent so it goes too
+        with CaptureQueriesContext(connection) as large:
+            response = save(edited=30, dropped=10, added=20)
+        self.assertEqual(response.json(), {'status': 'success', 'added': 20, 'updated': 19, 'unchanged': 30, 'deleted': 11})
+        self.assertEqual(len(large), len(small))
+        self.assertEqual(ItemTable.objects.get(id=other_id).front, 'other')
+        self.assertEqual(TopicItem.objects.filter(topic_id=topic_id).count(), 69)
+        print_success("edit_items_in_topic_full diff")
+
+    # 20. (COLLECTION EDITS) editing a collection's topics costs the same few queries for 2 topics as for 40
+    def test_edit_topics_in_collection_queries(self):
+        print("Testing collection topic edit queries...")
+        self.login_user_for_tests('user1', 'password')
+        collection_id = self.json_post_req('create_collection', {'collection_name': 'Collection'}).json()['id']
+        topic_ids = [self.json_post_req('create_topic', {'topic_name': f'Topic{i}'}).json()['id'] for i in range(40)]
+
+        def active_topics():
+            return dict(CollectionTopic.objects.filter(collection_id=collection_id).values_list('topic_id', 'is_active'))
+
+        with CaptureQueriesContext(connection) as small:
+            self.json_post_req('edit_topics_in_collection', {'collection_id': collection_id, 'topic_edits': [[id, 'add'] for id in topic_ids[:2]]})
+        with CaptureQueriesContext(connection) as large:
+            self.json_post_req('edit_topics_in_collection', {'collection_id': collection_id, 'topic_edits': [[id, 'add'] for id in topic_ids]})
+        self.assertEqual(len(large), len(small))
+        self.assertLess(len(large), 15)
+        edits = [[id, 'update'] for id in topic_ids[:10]] + [[id, 'delete'] for id in topic_ids[30:]] + [[topic_ids[0], 'update']]
+        self.json_post_req('edit_topics_in_collection', {'collection_id': collection_id, 'topic_edits': edits})
+        self.assertEqual(active_topics(), {id: not 1 <= i < 10 for i, id in enumerate(topic_ids[:30])})
+        response = self.json_post_req('edit_topics_in_collection', {'collection_id': collection_id, 'topic_edits': [[topic_ids[35], 'update']]})
+        self.assertEqual(response.status_code, 404)
+
+        statuses = ['active', 'inactive', 'not_selected']
+        final_topics = [{'topic_id': id, 'status': statuses[i % 3]} for i, id in enumerate(topic_ids[10:])]
+        with CaptureQueriesContext(connection) as full:
+            self.json_post_req('edit_topics_in_collection_full', {'collection_id': collection_id, 'topics': final_topics})
+        self.assertLess(len(full), 15)
+        self.assertEqual(active_topics(), {id: i % 3 == 0 for i, id in enumerate(topic_ids[10:]) if i % 3 != 2})
+
+        # someone else's topic stops the whole edit
+        self.login_user_for_tests('user2', 'password')
+        other_id = self.json_post_req('create_topic', {'topic_name': 'Private'}).json()['id']
+        self.login_user_for_tests('user1', 'password')
+        response = self.json_post_req('edit_topics_in_collection', {'collection_id': collection_id, 'topic_edits': [[topic_ids[0], 'add'], [other_id, 'add']]})
+        self.assertEqual(response.status_code, 401)
+        self.assertNotIn(topic_ids[0], active_topics())
+        print_success("collection topic edit queries")
+
+    # 21. (IMPORT) deck files are streamed in chunks, with a topic column, Anki headers and bad rows reported by line
+    def test_import_items(self):
+        print("Testing import_items...")
+        self.login_user_for_tests('user1', 'password')
+        topic_id = self.json_post_req('create_topic', {'topic_name': 'Default'}).json()['id']
+
+        lines = ['front,back,topic', 'a,b,', '"with, comma",b,Spanish', ',blank,', 'c,' + 'x' * 201 + ',', 'only front', 'd,e,Spanish']
+        upload = io.BytesIO('\n'.join(lines).encode())
+        upload.name = 'deck.csv'
+        response = self.client.post(reverse('import_items'), {'file': upload, 'topic_id': topic_id}, format='multipart')
+        result = response.json()
+        self.assertEqual((result['rows'], result['imported'], result['skipped'], result['error_count']), (6, 3, 1, 2))
+        self.assertEqual([error['line'] for error in result['errors']], [5, 6])
+        spanish = TopicTable.objects.get(user=self.user1, topic_name='Spanish')
+        self.assertEqual(result['topics_created'], [spanish.id])
+        self.assertEqual(sorted(spanish.items.values_list('front', flat=True)), ['d', 'with, comma'])
+        self.assertEqual(list(TopicTable.objects.get(id=topic_id).items.values_list('front', flat=True)), ['a'])
+
+        # csv.reader only takes one character, a longer delimiter is turned away before anything is read
+        upload = io.BytesIO(b'a;;b')
+        upload.name = 'deck.csv'
+        response = self.client.post(reverse('import_items'), {'file': upload, 'topic_id': topic_id, 'delimiter': ';;'}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+        # anki export, small chunks, from the command
+        path = os.path.join(tempfile.mkdtemp(), 'deck.txt')
+        with open(path, 'w') as f:
+            f.write('#separator:tab\n#html:false\n#deck column:3\n' + ''.join(f'front{i}\tback{i}\tAnki\n' for i in range(25)))
+        out = io.StringIO()
+        call_command('import_items', path, user='user1', chunk_size=10, stdout=out)
+        self.assertEqual(TopicTable.objects.get(user=self.user1, topic_name='Anki').items.count(), 25)
+        self.assertEqual(out.getvalue().count('imported\n'), 3)
+        print_success("import_items")
+
+    # 22. (EXPORT) a collection streams out as ndjson or csv with the caller's scores, and the csv imports back
+    def test_export_items(self):
+        print("Testing export_items...")
+        self.login_user_for_tests('user1', 'password')
+        collection_id = self.json_post_req('create_collection', {'collection_name': 'Collection'}).json()['id']
+        topic_ids = [self.json_post_req('create_topic', {'topic_name': f'Topic{i}'}).json()['id'] for i in range(2)]
+        self.json_post_req('edit_topics_in_collection', {'collection_id': collection_id, 'topic_edits': [[id, 'add'] for id in topic_ids]})
+        for topic_id in topic_ids:
+            self.json_post_req('add_items_to_topic', {'topic_id': topic_id, 'items': [[f'front{topic_id}{i}', 'back, with comma'] for i in range(3)]})
+        user_item = UserItem.objects.filter(user=self.user1).order_by('id').first()
+        self.json_post_req('update_n_items_user', {'items': [{'item_id': user_item.id, 'increment': 1}]})
+
+        response = self.json_get_req('export_items', {'collection_id': collection_id})
+        self.assertTrue(response.streaming)
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([line['type'] for line in lines], ['collection'] + ['topic'] * 2 + ['item'] * 6)
+        self.assertEqual(lines[0]['active_topics'], topic_ids)
+        self.assertEqual({line['id']: line['score'] for line in lines[3:]}[user_item.item_id], 1)
+
+        response = self.json_get_req('export_items', {'topic_id': topic_ids[0], 'export_format': 'csv'})
+        exported = b''.join(response.streaming_content)
+        self.assertEqual(exported.decode().splitlines()[0], 'front,back,topic,score,last_seen')
+
+        # somebody else can't read it, but can import a copy of what they're given
+        self.login_user_for_tests('user2', 'password')
+        response = self.json_get_req('export_items', {'collection_id': collection_id})
+        self.assertEqual(response.status_code, 401)
+
+        # once the collection is public they get its public topics, not the private ones kept in it
+        CollectionTable.objects.filter(id=collection_id).update(visibility='global_view')
+        TopicTable.objects.filter(id=topic_ids[1]).update(visibility='global_view')
+        response = self.json_get_req('export_items', {'collection_id': collection_id})
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([line['type'] for line in lines], ['collection', 'topic'] + ['item'] * 3)
+        self.assertEqual(lines[0]['active_topics'], [topic_ids[1]])
+        self.assertEqual({line['topic'] for line in lines[2:]}, {topic_ids[1]})
+        upload = io.BytesIO(exported)
+        upload.name = 'export.csv'
+        result = self.client.post(reverse('import_items'), {'file': upload}, format='multipart').json()
+        self.assertEqual((result['imported'], result['error_count']), (3, 0))
+        copy = TopicTable.objects.get(user__username='user2', topic_name='Topic0')
+        self.assertEqual(set(copy.items.values_list('back', flat=True)), {'back, with comma'})
+        print_success("export_items")
+
+    # 23. (JOBS) heavy mutations past JOB_INLINE_LIMIT are queued, run by the worker in chunks, and resumed after a crash
+    def test_jobs(self):
+        print("Testing background jobs...")
+        self.login_user_for_tests('user1', 'password')
+        collection_id = self.json_post_req('create_collection', {'collection_name': 'Collection'}).json()['id']
+        topic_id = self.json_post_req('create_topic', {'topic_name': 'Big'}).json()['id']
+        kept_id = self.json_post_req('create_topic', {'topic_name': 'Kept'}).json()['id']
+        self.json_post_req('edit_topics_in_collection', {'collection_id': collection_id, 'topic_edits': [[topic_id, 'add']]})
+        item_ids = self.json_post_req('add_items_to_topic', {'topic_id': topic_id, 'items': [[f'front{i}', f'back{i}'] for i in range(30)]}).json()['item_ids']
+        TopicItem.objects.create(topic_id=kept_id, item_id=item_ids[0])
+
+        with mock.patch.object(jobs, 'JOB_INLINE_LIMIT', 10), mock.patch.object(jobs, 'JOB_CHUNK_SIZE', 7):
+            response = self.json_post_req('delete_topic', {'topic_id': topic_id})
+            self.assertEqual(response.status_code, 202)
+            job_id = response.json()['job']['id']
+            self.assertTrue(TopicTable.objects.filter(id=topic_id).exists())
+
+            # a worker that claimed it and died, its lease runs out and the next worker takes over
+            crashed = jobs.claim()
+            Job.objects.filter(id=crashed.id).update(lease_until=timezone.now() - timedelta(seconds=1))
+            self.assertEqual(jobs.run_pending(), 1)
+
+        job = self.url_get_req('get_job', {'job_id': job_id}).json()
+        self.assertEqual((job['status'], job['progress']), ('done', {'collection_topics': 1, 'topic_items': 30, 'orphans': 29}))
+        self.assertEqual(Job.objects.get(id=job_id).attempts, 2)
+        self.assertFalse(TopicTable.objects.filter(id=topic_id).exists())
+        self.assertEqual(list(ItemTable.objects.filter(id__in=item_ids).values_list('id', flat=True)), [item_ids[0]])
+
+        # small ones still happen in the request
+        small_id = self.json_post_req('create_topic', {'topic_name': 'Small'}).json()['id']
+        response = self.json_post_req('delete_topic', {'topic_id': small_id})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(TopicTable.objects.filter(id=small_id).exists())
+
+        # import interrupted after its first chunk picks up where it stopped, the file waits in the database in chunks
+        upload = io.BytesIO(''.join(f'front{i},back{i}\n' for i in range(25)).encode())
+        upload.name = 'deck.csv'
+        with mock.patch.object(views, 'IMPORT_INLINE_MAX_BYTES', 10), mock.patch.object(importer, 'IMPORT_CHUNK_SIZE', 10), \
+                mock.patch.object(jobs, 'JOB_UPLOAD_CHUNK_SIZE', 50):
+            response = self.client.post(reverse('import_items'), {'file': upload, 'topic_id': kept_id}, format='multipart')
+            self.assertEqual(response.status_code, 202)
+            job = Job.objects.get(id=response.json()['job']['id'])
+            self.assertEqual(JobUpload.objects.filter(job=job).count(), -(-upload.tell() // 50))
+            job.attempts = 1
+            job.progress = importer.Importer(self.user1, default_topic=TopicTable.objects.get(id=kept_id), chunk_size=10).run(
+                [f'front{i},back{i}' for i in range(10)])
+            job.save()
+            jobs.run_pending()
+            self.assertFalse(JobUpload.objects.filter(job=job).exists())
+
+            upload.seek(0)
+            with mock.patch.object(views, 'IMPORT_MAX_BYTES', 10):
+                response = self.client.post(reverse('import_items'), {'file': upload, 'topic_id': kept_id}, format='multipart')
+            self.assertEqual(response.status_code, 413)
+        self.assertEqual(self.url_get_req('get_all_jobs').json()[0]['progress']['imported'], 25)
+        self.assertEqual(TopicTable.objects.get(id=kept_id).items.count(), 26)
+
+        # a checkpoint that doesn't make it takes its chunk with it, so the resumed job can't write it twice
+        def checkpoint(progress):
+            if progress['imported'] > 10:
+                raise RuntimeError('worker died')
+        with self.assertRaises(RuntimeError):
+            importer.Importer(self.user1, default_topic=TopicTable.objects.get(id=kept_id), chunk_size=10, progress=checkpoint).run(
+                [f'checkpoint{i},back{i}' for i in range(20)])
+        self.assertEqual(ItemTable.objects.filter(front__startswith='checkpoint').count(), 10)
+
+        # unsharing a topic takes it out of other people's collections
+        self.json_post_req('edit_topic_info', {'topic_id': kept_id, 'edits': {'visibility': 'global_view'}})
+        self.login_user_for_tests('user2', 'password')
+        other_collection_id = self.json_post_req('create_collection', {'collection_name': 'Borrowed'}).json()['id']
+        self.json_post_req('edit_topics_in_collection', {'collection_id': other_collection_id, 'topic_edits': [[kept_id, 'add']]})
+        self.login_user_for_tests('user1', 'password')
+        self.json_post_req('edit_topics_in_collection', {'collection_id': collection_id, 'topic_edits': [[kept_id, 'add']]})
+        response = self.json_post_req('edit_topic_info', {'topic_id': kept_id, 'edits': {'visibility': 'private'}})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(CollectionTopic.objects.filter(topic_id=kept_id).values_list('collection_id', flat=True)), [collection_id])
+        print_success("background jobs")
+
+    # 24. (SPARSE SCORES) studying someone's public collection creates score rows only for the cards handed out or reviewed
+    def test_lazy_user_items(self):
+        print("Testing lazy user items...")
+        self.login_user_for_tests('user1', 'password')
+        collection_id = self.json_post_req('create_collection', {'collection_name': 'Public', 'visibility': 'global_view'}).json()['id']
+        topic_id = self.json_post_req('create_topic', {'topic_name': 'Shared', 'visibility': 'global_view'}).json()['id']
+        self.json_post_req('edit_topics_in_collection', {'collection_id': collection_id, 'topic_edits': [[topic_id, 'add']]})
+        item_ids = self.json_post_req('add_items_to_topic', {'topic_id': topic_id, 'items': [[f'front{i}', f'back{i}'] for i in range(40)]}).json()['item_ids']
+
+        self.login_user_for_tests('user2', 'password')
+        params = {'collection_id': collection_id, 'n_old': 0, 'n_zero': 5}
+        cards = self.json_get_req('fetch_n_from_collection', params).json()
+        self.assertEqual(len(cards), 5)
+        self.assertEqual(UserItem.objects.filter(user=self.user2).count(), 5)
+        self.assertEqual({card['user'] for card in cards}, {self.user2.id})
+        response = self.json_post_req('update_n_items_user', {'items': [{'item_id': card['id'], 'increment': 1} for card in cards]})
+        self.assertEqual(response.json()['updated'], 5)
+
+        # by card id, for cards never handed out
+        unseen = [id for id in item_ids if not UserItem.objects.filter(user=self.user2, item_id=id).exists()][:2]
+        response = self.json_post_req('update_n_items_user', {'items': [{'card_id': id, 'increment': 1} for id in unseen] + [{'card_id': 999999, 'increment': 1}]})
+        self.assertEqual((response.json()['updated'], response.json()['errors'][0]['card_id']), (2, 999999))
+        self.assertEqual(UserItem.objects.filter(user=self.user2, score=1).count(), 7)
+
+        # the rest are still new, and the reviewed ones aren't
+        cards = self.json_get_req('fetch_n_from_collection', {**params, 'n_zero': 100}).json()
+        self.assertEqual(len(cards), 33)
+        self.assertEqual(UserItem.objects.filter(user=self.user2).count(), 40)
+
+        # a private topic the owner keeps in the public collection stays theirs
+        self.login_user_for_tests('user1', 'password')
+        private_id = self.json_post_req('create_topic', {'topic_name': 'Private'}).json()['id']
+        self.json_post_req('edit_topics_in_collection', {'collection_id': collection_id, 'topic_edits': [[private_id, 'add']]})
+        self.json_post_req('add_items_to_topic', {'topic_id': private_id, 'items': [['secret front', 'secret back']]})
+        self.login_user_for_tests('user2', 'password')
+        cards = self.json_get_req('fetch_n_from_collection', {**params, 'n_zero': 100}).json()
+        self.assertNotIn('secret front', [card['front'] for card in cards])
+        self.assertFalse(UserItem.objects.filter(user=self.user2, item__front='secret front').exists())
+        print_success("lazy user items")
+
+
+    # 25. (DEDUPLICATION) cards are found by content_hash, linked or skipped on request, and shared cards survive edits and deletes elsewhere
+    def test_content_hash_dedup(self):
+        print("Testing content hash deduplication...")
+        self.login_user_for_tests('user1', 'password')
+        first_id = self.json_post_req('create_topic', {'topic_name': 'First'}).json()['id']
+        second_id = self.json_post_req('create_topic', {'topic_name': 'Second'}).json()['id']
+        item_ids = self.json_post_req('add_items_to_topic', {'topic_id': first_id, 'items': [['Hola', 'Hello'], ['Adios', 'Bye']]}).json()['item_ids']
+        self.assertEqual(ItemTable.objects.get(id=item_ids[0]).content_hash, content_hash(' hola', 'HELLO  '))
+
+        # create (the default) still makes a new card but reports it, skip leaves it out, link reuses it
+        items = [['hola ', 'hello'], ['Gato', 'Cat'], ['gato', 'cat']]
+        response = self.json_post_req('add_items_to_topic', {'topic_id': second_id, 'items': items, 'on_duplicate': 'bogus'})
+        self.assertEqual(response.status_code, 400)
+        response = self.json_post_req('add_items_to_topic', {'topic_id': second_id, 'items': items, 'on_duplicate': 'skip'}).json()
+        self.assertEqual(response['item_ids'][0], None)
+        self.assertEqual([(d['index'], d['item_id']) for d in response['duplicates']], [(0, item_ids[0]), (2, response['item_ids'][1])])
+        response = self.json_post_req('add_items_to_topic', {'topic_id': second_id, 'items': [['HOLA', 'hello'], ['Adios', 'Bye'], ['Perro', 'Dog']], 'on_duplicate': 'link'}).json()
+        self.assertEqual(response['item_ids'][:2], item_ids)
+        self.assertEqual(TopicItem.objects.filter(item_id=item_ids[0]).count(), 2)
+        response = self.json_post_req('add_items_to_topic', {'topic_id': first_id, 'items': [['Adios', 'Bye']]}).json()
+        self.assertNotEqual(response['item_ids'][0], item_ids[1])
+        self.assertEqual(response['duplicates'], [{'index': 0, 'item_id': item_ids[1]}])
+
+        # editing a shared card in one topic copies it, the other topic keeps the old text
+        items = [{'id': id, 'front': front, 'back': back} for id, front, back in TopicItem.objects.filter(topic_id=second_id).values_list('item_id', 'item__front', 'item__back')]
+        for item in items:
+            if item['id'] == item_ids[0]:
+                item['back'] = 'Hi'
+        response = self.json_post_req('edit_items_in_topic_full', {'topic_id': second_id, 'items': items})
+        self.assertEqual(response.json()['updated'], 1)
+        self.assertEqual(ItemTable.objects.get(id=item_ids[0]).back, 'Hello')
+        self.assertTrue(TopicItem.objects.filter(topic_id=second_id, item__back='Hi').exists())
+
+        # deleting a card or the topic only takes it out, while another topic holds it
+        items = [item for item in items if item['id'] != item_ids[1]]
+        self.json_post_req('edit_items_in_topic_full', {'topic_id': second_id, 'items': items})
+        self.assertTrue(ItemTable.objects.filter(id=item_ids[1]).exists())
+        self.assertFalse(TopicItem.objects.filter(topic_id=second_id, item_id=item_ids[1]).exists())
+        self.json_post_req('delete_topic', {'topic_id': first_id})
+        self.assertFalse(ItemTable.objects.filter(id__in=item_ids).exists())
+
+        # imports count duplicates, and link them into the topic on request
+        deck = io.BytesIO('front,back\nGato,Cat\nPerro,Dog\nPez,Fish\npez,fish\n'.encode())
+        third_id = self.json_post_req('create_topic', {'topic_name': 'Third'}).json()['id']
+        response = self.client.post(reverse('import_items'), {'file': deck, 'topic_id': third_id, 'on_duplicate': 'link'}, format='multipart').json()
+        self.assertEqual((response['imported'], response['linked'], response['duplicates']), (1, 2, 3))
+        self.assertEqual(TopicItem.objects.filter(topic_id=third_id).count(), 3)
+        self.assertEqual(TopicItem.objects.filter(topic_id=second_id, item__front='Gato').count(), 1)
+        print_success("content hash deduplication")
+
+    # 26. (AUTH) request.user comes from the token claims, its other fields are loaded once and cached until the user is saved
+    def test_claims_authentication(self):
+        print("Testing claims authentication...")
+        response = self.login_user_for_tests('user1', 'password')
+        self.assertEqual(AccessToken(response.json()['access'])['username'], 'user1')
+
+        # the profile needs the other fields: one query, then none while cached
+        with self.assertNumQueries(1):
+            self.assertEqual(self.json_get_req('view_profile').json()['username'], 'user1')
+        with self.assertNumQueries(0):
+            self.json_get_req('view_profile')
+
+        # saving the user drops it from the cache
+        self.json_post_req('edit_profile', {'realname': 'Ada'})
+        self.assertEqual(self.json_get_req('view_profile').json()['realname'], 'Ada')
+        self.user1.set_password('changed')
+        self.user1.save()
+        with self.assertNumQueries(1):
+            self.json_get_req('view_profile')
+
+        # tokens without the username claim still work, through the usual lookup
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user2).access_token}')
+        self.assertEqual(self.json_get_req('view_profile').json()['username'], 'user2')
+        print_success("claims authentication")
+
+    # 27. (PERMISSIONS) the database filters what a user can see or edit, in one query whatever the number of objects
+    def test_permission_querysets(self):
+        print("Testing permission querysets...")
+        visibilities = ['private', 'global_view', 'global_edit']
+        topics = {v: TopicTable.objects.create(user=self.user1, topic_name=v, visibility=v) for v in visibilities}
+        mine = TopicTable.objects.create(user=self.user2, topic_name='mine')
+
+        self.assertEqual(set(TopicTable.objects.viewable_by(self.user2)), {topics['global_view'], topics['global_edit'], mine})
+        self.assertEqual(set(TopicTable.objects.editable_by(self.user2)), {topics['global_edit'], mine})
+        self.assertEqual(set(TopicTable.objects.owned_by(self.user1, self.user2)), {topics['global_view'], topics['global_edit']})
+        self.assertEqual(TopicTable.objects.owned_by(self.user1, self.user1).count(), 3)
+
+        # browsing someone's topics goes through the (user, visibility) index
+        self.assertIn('topic_user_visibility', TopicTable.objects.owned_by(self.user1, self.user2).explain())
+
+        # 404 for what doesn't exist, 401 for what isn't yours, checked for all the topics at once
+        self.login_user_for_tests('user2', 'password')
+        collection_id = self.json_post_req('create_collection', {'collection_name': 'Mixed'}).json()['id']
+        response = self.json_post_req('edit_topics_in_collection', {'collection_id': collection_id, 'topic_edits': [[mine.id, 'add'], [topics['global_view'].id, 'add']]})
+        self.assertEqual(response.status_code, 401)
+        response = self.json_post_req('edit_topics_in_collection', {'collection_id': collection_id, 'topic_edits': [[mine.id, 'add'], [999999, 'add']]})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.url_get_req('get_topic_items', {'topic_id': topics['private'].id}).status_code, 401)
+        self.assertEqual(self.url_get_req('get_topic_items', {'topic_id': topics['global_view'].id}).status_code, 200)
+
+        edits = [[topic.id, 'add'] for topic in [topics['global_edit'], mine] + [TopicTable.objects.create(user=self.user2, topic_name=f'More{i}') for i in range(20)]]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.json_post_req('edit_topics_in_collection', {'collection_id': collection_id, 'topic_edits': edits})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sum('FROM "api_topictable"' in query['sql'] for query in queries.captured_queries), 1)
+        print_success("permission querysets")
+
+    # 28. (INDEXES) the study and browse queries are index lookups, not table scans. INDEX_TEST_ROWS sets the seeded
+    # size, e.g. INDEX_TEST_ROWS=1000000 for a full sized check. Indexes are matched by name, or by the columns searched
+    # where SQLite names them itself (the unique constraints)
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite query plans')
+    def test_query_plans(self):
+        print("Testing query plans...")
+        n_rows = int(os.environ.get('INDEX_TEST_ROWS', 2000))
+        topic = TopicTable.objects.create(user=self.user1, topic_name='Big', visibility='global_view')
+        collection = CollectionTable.objects.create(user=self.user1, collection_name='Big')
+        CollectionTopic.objects.create(collection=collection, topic=topic, is_active=True)
+        # other people's topics and collections around it, mostly private
+        others = TopicTable.objects.bulk_create([TopicTable(user=self.user2, topic_name=f'T{i}', visibility='private' if i % 10 else 'global_view') for i in range(n_rows // 10)])
+        collections = CollectionTable.objects.bulk_create([CollectionTable(user=self.user2, collection_name=f'C{i}') for i in range(n_rows // 10)])
+        CollectionTopic.objects.bulk_create([CollectionTopic(collection=c, topic=t, is_active=i % 3 == 0) for i, (c, t) in enumerate(zip(collections, others))])
+        for start in range(0, n_rows, 10000):
+            items = ItemTable.objects.bulk_create([ItemTable(front=f'f{i}', back=f'b{i}') for i in range(start, min(start + 10000, n_rows))])
+            TopicItem.objects.bulk_create([TopicItem(topic=topic if item.id % 10 == 0 else others[item.id % len(others)], item=item) for item in items])
+            UserItem.objects.bulk_create([UserItem(user=self.user1, item=item, score=i % 5) for i, item in enumerate(items) if i % 2])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        now = timezone.now()
+        active_topic_ids = CollectionTopic.objects.filter(collection=collection, is_active=True).values('topic_id')
+        item_ids = TopicItem.objects.filter(topic_id__in=active_topic_ids).values('item_id')
+        mine = UserItem.objects.filter(user=self.user1, item=OuterRef('pk'))
+        queries = {
+            'active topics': (active_topic_ids, 'collectiontopic_active'),
+            'topic items': (TopicItem.objects.filter(topic=topic), r'INDEX \w+ \(topic_id=\?'),
+            'new cards': (ItemTable.objects.filter(id__in=item_ids).filter(~Exists(mine)).order_by('sample_key'), r'INDEX \w+ \(user_id=\? AND item_id=\?\)'),
+            'due cards': (UserItem.objects.filter(user=self.user1, item_id__in=item_ids, due_at__lte=now).order_by('due_at'), r'INDEX \w+ \(user_id=\?'),
+            'shared topics': (TopicTable.objects.owned_by(self.user1, self.user2), 'topic_user_visibility'),
+        }
+        for name, (queryset, index) in queries.items():
+            plan = queryset.explain()
+            self.assertRegex(plan, index, f'{name}:\n{plan}')
+            self.assertNotRegex(plan, r'(?m)^.*SCAN api_\w+\s*$', f'{name}:\n{plan}') # a bare SCAN, on any line, reads the whole table
+        print_success("query plans")
+
+    # 29. (SQLITE) new SQLite connections get SQLITE_PRAGMAS and start their transactions with BEGIN IMMEDIATE
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+    def test_sqlite_connection_setup(self):
+        print("Testing sqlite connection setup...")
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS['busy_timeout'])
+
+        # a connection to a file, made with the settings switched
+        with tempfile.TemporaryDirectory() as directory:
+            other = connection.copy()
+            other.settings_dict['NAME'] = os.path.join(directory, 'other.sqlite3')
+            with override_settings(SQLITE_PRAGMAS={'journal_mode': 'wal', 'busy_timeout': 1234}, SQLITE_TRANSACTION_MODE=None):
+                other.connect()
+            try:
+                with other.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone()[0], 'wal')
+                    cursor.execute('PRAGMA busy_timeout')
+                    self.assertEqual(cursor.fetchone()[0], 1234)
+                self.assertNotIn('_start_transaction_under_autocommit', vars(other))
+            finally:
+                other.close()
+
+            # what atomic() does on a fresh connection has to take the write lock straight away, so another writer that
+            # doesn't wait is turned away before this transaction has written anything. If Django stops going through
+            # _start_transaction_under_autocommit (or the OPTION on 5.1+) this transaction is deferred and that write gets in
+            other = connection.copy()
+            other.settings_dict['NAME'] = os.path.join(directory, 'locked.sqlite3')
+            other.connect()
+            try:
+                other.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
+                writer = sqlite3.connect(other.settings_dict['NAME'], timeout=0)
+                with self.assertRaisesRegex(sqlite3.OperationalError, 'locked'):
+                    writer.execute('CREATE TABLE t (id INTEGER)')
+                writer.close()
+            finally:
+                other.rollback()
+                other.close()
+        print_success("sqlite connection setup")
+
+    # 30. (REPLICAS) GET reads go to the replica, writes and the user's reads right after a write to the primary.
+    # The replica is a second SQLite file, with a topic the primary doesn't have to tell them apart
+    def test_read_replica_routing(self):
+        print("Testing read replica routing...")
+        self.login_user_for_tests('user1', 'password')
+        with tempfile.TemporaryDirectory() as directory:
+            connections.settings['replica_test'] = {**connections['default'].settings_dict, 'NAME': os.path.join(directory, 'replica.sqlite3')}
+            try:
+                call_command('migrate', database='replica_test', verbosity=0)
+                CustomUser.objects.using('replica_test').create(id=self.user1.id, username='user1')
+                TopicTable.objects.using('replica_test').create(user_id=self.user1.id, topic_name='On the replica')
+
+                with override_settings(REPLICA_DATABASES=['replica_test']):
+                    self.assertFalse(db.ReplicaRouter().allow_migrate('replica_test', 'api'))
+                    # one replica per request, whatever the number of queries
+                    with mock.patch.object(db.random, 'choice', wraps=db.random.choice) as choice:
+                        response = self.url_get_req('get_all_topics')
+                    self.assertEqual(choice.call_count, 1)
+                    self.assertEqual([topic['topic_name'] for topic in response.json()], ['On the replica'])
+
+                    # the write goes to the primary, and pins the user's next reads there, on the server (no cookie to keep)
+                    response = self.json_post_req('create_topic', {'topic_name': 'On the primary'})
+                    self.assertTrue(TopicTable.objects.using('default').filter(topic_name='On the primary').exists())
+                    self.client.cookies.clear()
+                    response = self.url_get_req('get_all_topics')
+                    self.assertEqual([topic['topic_name'] for topic in response.json()], ['On the primary'])
+
+                    # once the pin runs out it's the replica again, and outside requests it's always the primary
+                    cache.delete(db._pin_key(self.user1.id))
+                    self.assertEqual([topic['topic_name'] for topic in self.url_get_req('get_all_topics').json()], ['On the replica'])
+                    self.assertEqual(TopicTable.objects.get().topic_name, 'On the primary')
+            finally:
+                connections['replica_test'].close()
+                del connections['replica_test']
+                del connections.settings['replica_test']
+        print_success("read replica routing")
+
+# the batch (NumPy) path of the scheduler has to agree with the per card path the views use
+class SchedulerTestCase(SimpleTestCase):
+    def test_batch_matches_scalar(self):
+        scheduler = get_scheduler()
+        now = timezone.now()
+        scores = np.repeat(np.arange(scheduler.max_score_backend + 1), 2)
+        increments = np.tile([1, -1], scheduler.max_score_backend + 1)
+        last_seens = [now - timedelta(minutes=10 * i) for i in range(len(scores))]
+
+        self.assertEqual(scheduler.client_scores(scores).tolist(), [scheduler.client_score(s) for s in scores.tolist()])
+        self.assertEqual(
+            scheduler.next_scores(scores, increments).tolist(),
+            [scheduler.next_score(s, i) for s, i in zip(scores.tolist(), increments.tolist())],
+        )
+        self.assertEqual(
+            scheduler.due_mask(scores, to_epoch(last_seens), now.timestamp()).tolist(),
+            [scheduler.is_due(s, ls, now) for s, ls in zip(scores.tolist(), last_seens)],
+        )
+        self.assertEqual(
+            scheduler.due_ats(scores, to_epoch(last_seens)).tolist(),
+            [scheduler.due_at(s, ls).timestamp() for s, ls in zip(scores.tolist(), last_seens)],
+        )
+
+    # a scheduler missing part of the interface fails when it is made, not on the first request that needs it
+    def test_incomplete_scheduler(self):
+        class NoBatch(LevelScheduler):
+            due_ats = Scheduler.due_ats
+
+        with self.assertRaises(TypeError):
+            NoBatch()
+
+
+# the values_list fast paths have to render to exactly the same JSON as the DRF serializers they replace
+class FastSerializerTestCase(TestCase):
+    def setUp(self):
+        self.user1 = CustomUser.objects.create_user(username="user1", password="password")
+        self.user2 = CustomUser.objects.create_user(username="user2", password="password")
+        topic1 = TopicTable.objects.create(user=self.user1, topic_name='Topic1')
+        topic2 = TopicTable.objects.create(user=self.user2, topic_name='Topic2')
+        for i in range(6):
+            item = ItemTable.objects.create(front=f'front {i} ü "quoted"', back=f'back {i}')
+            UserItem.objects.create(user=self.user1, item=item, score=i + 3)
+            TopicItem.objects.create(topic=topic1, item=item)
+            if i % 2:
+                UserItem.objects.create(user=self.user2, item=item, score=8)
+                TopicItem.objects.create(topic=topic2, item=item)
+        self.topic1 = topic1
+
+    def test_user_items_identical(self):
+        user_items = UserItem.objects.filter(user=self.user1)
+        self.assertEqual(
+            JSONRenderer().render(fast_serializers.user_item_rows(user_items)),
+            JSONRenderer().render(UserItemSerializer(user_items, many=True).data),
+        )
+
+    def test_topic_items_identical(self):
+        topic_items = TopicItem.objects.filter(topic=self.topic1)
+        self.assertEqual(
+            JSONRenderer().render(fast_serializers.topic_item_rows(topic_items)),
+            JSONRenderer().render([ItemTableSerializer(topic_item.item).data for topic_item in topic_items]),
+        )
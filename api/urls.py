@@ -17,6 +17,7 @@ urlpatterns = [
     path('get_all_items/<int:topic_id>/', views.get_all_items, name='get_all_items'),  #maybe not using? 
     path('get_all_topics/', views.get_all_topics, name='get_all_topics'), #for self
     path('get_all_collections/', views.get_all_collections, name='get_all_collections'), #for self
+    path('sync/', views.sync_changes, name='sync'), #for self, only what changed since the cursor
 
     # browsing others
     path('view_profile/<int:user_id>/', views.view_profile, name='view_profile'),
@@ -46,11 +47,17 @@ urlpatterns = [
     # change visibility, description, or <collection/topic>_name
     path('edit_topic_info/', views.edit_topic_info, name='edit_topic_info'),
     path('edit_collection_info/', views.edit_collection_info, name='edit_collection_info'),
+    path('import_items/', views.import_items, name='import_items'), #deck files, streamed in chunks
+    path('export_items/', views.export_items, name='export_items'), #streamed backup of a collection or topic
+    path('get_all_jobs/', views.get_all_jobs, name='get_all_jobs'), #for self, the 50 latest background jobs
+    path('get_job/<int:job_id>/', views.get_job, name='get_job'),
 
 
     # study-mode
     path('fetch_n_from_collection/', views.fetch_n_from_collection, name='fetch_n_from_collection'), #send to client next cards to study
     path('update_n_items_user/', views.update_n_items_user, name='update_n_items_user'), #send back over the scores
+    path('study_queue_stats/', views.study_queue_stats, name='study_queue_stats'), #admin only, cache hit/miss counters
+    path('review_log_stats/', views.review_log_stats, name='review_log_stats'), #admin only, review history write costs
 
     # the difficult ones, will be changing visibilities, and adding global collections/topics into your sets. Because of the manual cascading
 
@@ -1,8 +1,9 @@
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse,  Http404
+from django.http import JsonResponse,  Http404, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Exists, OuterRef
 from django.utils import timezone
 
 
@@ -10,18 +11,23 @@ from django.shortcuts import get_object_or_404
 
 
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 
+import csv
 import json
+import random
 from rest_framework import status
-from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
-from .models import CustomUser, TopicTable, CollectionTable, CollectionTopic, ItemTable, UserItem, TopicItem
+from .models import CustomUser, TopicTable, CollectionTable, CollectionTopic, ItemTable, UserItem, TopicItem, ChangeLog, Job, \
+    SHARED_VISIBILITIES, viewable_filter
+from .scheduler import get_scheduler
+from .authentication import tokens_for
+from . import study_queue, review_log, sync, fast_serializers, importer, exporter, jobs, cards
 from .serializers import CustomUserSerializer, UserItemSerializer, ItemTableSerializer, CollectionTableSerializer,\
       CollectionTopicSerializer, TopicTableSerializer, GetTopicTableSerializer
       
@@ -33,6 +39,9 @@ from django.utils import timezone
 MAX_TOPICS_PER_USER = 40
 MAX_COLLECTIONS_PER_USER = 10
 MAX_ITEMS_PER_TOPIC = 200
+IMPORT_INLINE_MAX_BYTES = 1024 * 1024 # bigger import files are handed to the job worker
+IMPORT_MAX_BYTES = 50 * 1024 * 1024 # import files over this are refused with a 413
+ITEM_SIDE_MAX_LENGTH = ItemTable._meta.get_field('front').max_length
 
 
 
@@ -65,7 +74,7 @@ def user_login(request):
     user = authenticate(request, username=username, password=password)
     print('user is : ', user)
     if user is not None:
-        refresh = RefreshToken.for_user(user)
+        refresh = tokens_for(user)
         response =  Response({
             'status': 'success',
             'user_id': user.id,  # Include the user ID in the response
@@ -121,7 +130,7 @@ def user_register(request):
         user.save()
         print('saved')
 
-        refresh = RefreshToken.for_user(user)
+        refresh = tokens_for(user)
         print("User registered successfully")
         return Response({
             'status': 'success',
@@ -164,6 +173,70 @@ def get_all_users(request):
 HELPERS
 =====
 """
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+# random sample of n ids of an ItemTable queryset, keyset style: start from a random pivot in the stored
+# sample_key and walk the index (wrapping around), instead of sorting every candidate by random()
+# pass a seed to get the same sample back, for tests and benchmarks
+def sample_items(items, n, seed=None):
+    if n <= 0:
+        return []
+    pivot = random.Random(seed).random()
+    sample = list(items.filter(sample_key__gte=pivot).order_by('sample_key').values_list('id', flat=True)[:n])
+    if len(sample) < n:
+        sample += list(items.filter(sample_key__lt=pivot).order_by('sample_key').values_list('id', flat=True)[:n - len(sample)])
+    return sample
+
+
+# what to study next among item_ids (a subquery): item ids of level 0 cards (random, not just seen) and
+# UserItem ids of the older cards (most overdue first), at least n_zero / n_old of each, more to fill up the study queue.
+# Scores are sparse, a card without a UserItem is a level 0 card never seen, so the level 0 side is an
+# anti-join over ItemTable and works the same for a shared topic nobody has studied yet
+def build_study_queue(user, item_ids, n_zero, n_old, seed=None):
+    now = timezone.now()
+    scheduler = get_scheduler()
+    mine = UserItem.objects.filter(user=user, item=OuterRef('pk'))
+    new_items = ItemTable.objects.filter(id__in=item_ids).filter(~Exists(mine) | Exists(mine.filter(scheduler.new_filter(now))))
+    zero_item_ids = sample_items(new_items, max(n_zero, study_queue.STUDY_QUEUE_SIZE) if n_zero else 0, seed=seed)
+    old_ids = list(
+        UserItem.objects.filter(user=user, item_id__in=item_ids).filter(scheduler.due_filter(now))
+        .exclude(item_id__in=zero_item_ids).order_by('due_at')
+        .values_list('id', flat=True)[:max(n_old, study_queue.STUDY_QUEUE_SIZE)]
+    )
+    return zero_item_ids, old_ids
+
+
+# who gets a UserItem for a card as it is created: whoever wrote it and the topic's owner (a global_edit topic
+# can be added to by others). Everybody else studying the topic gets theirs lazily, see materialize_user_items
+def card_holders(user, topic):
+    return list(dict.fromkeys([user.id, topic.user_id]))
+
+
+# UserItem ids for the user's cards with these item ids, in the same order, creating the missing ones in bulk.
+# Rows are only made for cards the user actually gets to study, never for a whole topic up front
+def materialize_user_items(user, item_ids):
+    existing = dict(UserItem.objects.filter(user=user, item_id__in=item_ids).values_list('item_id', 'id'))
+    missing = [item_id for item_id in dict.fromkeys(item_ids) if item_id not in existing]
+    if missing:
+        # (user, item) is unique, a fetch running at the same time may have made some of them already
+        UserItem.objects.bulk_create([UserItem(user=user, item_id=item_id) for item_id in missing], ignore_conflicts=True)
+        created = dict(UserItem.objects.filter(user=user, item_id__in=missing).values_list('item_id', 'id'))
+        existing.update(created)
+        sync.record(ChangeLog.USER_ITEM, created.values(), user_id=user.id)
+    return [existing[item_id] for item_id in item_ids]
+
+
+# what's wrong with a submitted [front, back] pair, if anything
+def item_pair_error(item):
+    if not isinstance(item, (list, tuple)) or len(item) != 2 or not all(isinstance(side, str) for side in item):
+        return "Both front and back should be provided."
+    if any(len(side) > ITEM_SIDE_MAX_LENGTH for side in item):
+        return f"Front and back can be at most {ITEM_SIDE_MAX_LENGTH} characters."
+    return None
+
+
 def get_user(request, user_id):
     if user_id is None:
         return request.user
@@ -171,27 +244,42 @@ def get_user(request, user_id):
         return get_object_or_404(CustomUser, id=user_id)
 
 
-def get_objects(user, request_user, model, serializer, context=None):
-    if user == request_user:
-        objects = model.objects.filter(user=user)
-    else:
-        objects = model.objects.filter(Q(user=user) & (Q(visibility='global_edit') | Q(visibility='global_view')))
-    
-    # Get the data with the request in the context to access it in the serializer
-    return serializer(objects, many=True, context=context).data
-
-
-
-# does user have access_type ('view' or 'edit') to object (obj)
-# later can extend for friends
-def has_access(obj, user, access_type):
-    if access_type == 'edit':
-        if obj.user != user and obj.visibility != 'global_edit':
-            return False
-    elif access_type == 'view':
-        if not (obj.user == user or obj.visibility in ('global_edit', 'global_view')):
-            return False 
-    return True 
+# the object with this id out of a permitted queryset (Model.objects.viewable_by/editable_by), and None,
+# or None and the error response: 404 if there is no such object at all, 401 if it isn't the user's to see or change.
+# later can extend for friends, in the querysets
+def get_permitted(queryset, object_id, error="Unauthorized"):
+    obj = queryset.filter(id=object_id).first()
+    if obj is not None:
+        return obj, None
+    get_object_or_404(queryset.model, id=object_id)
+    return None, Response({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
+
+
+# same for a set of ids, {id: object} when every one of them is permitted, all or nothing
+def get_all_permitted(queryset, object_ids, error="Unauthorized"):
+    object_ids = set(object_ids)
+    objects = queryset.in_bulk(object_ids)
+    if len(objects) == len(object_ids):
+        return objects, None
+    if queryset.model.objects.filter(id__in=object_ids).count() != len(object_ids):
+        raise Http404(f"No {queryset.model.__name__} matches the given query.")
+    return None, Response({"error": error}, status=status.HTTP_401_UNAUTHORIZED)
+
+
+# bring a collection's topics from current to desired, both {topic_id: is_active}, with set based writes
+# (one insert, at most two updates and one delete) whatever the number of topics
+def reconcile_collection_topics(collection, current, desired):
+    CollectionTopic.objects.bulk_create([
+        CollectionTopic(collection=collection, topic_id=topic_id, is_active=is_active)
+        for topic_id, is_active in desired.items() if topic_id not in current
+    ])
+    for is_active in (True, False):
+        changed = [topic_id for topic_id, active in desired.items() if active == is_active and current.get(topic_id, is_active) != is_active]
+        if changed:
+            collection.collectiontopic_set.filter(topic_id__in=changed).update(is_active=is_active)
+    removed = current.keys() - desired.keys()
+    if removed:
+        collection.collectiontopic_set.filter(topic_id__in=removed).delete()
 
 
 """
@@ -226,8 +314,8 @@ def edit_profile(request):
 @permission_classes([IsAuthenticated])
 def get_all_items(request, topic_id = None):
     user_items = UserItem.objects.filter(user=request.user)
-    serializer = UserItemSerializer(user_items, many=True)
-    return Response(serializer.data, content_type='application/json; charset=utf-8')
+    data = fast_serializers.user_item_rows(user_items) # same output as UserItemSerializer(user_items, many=True)
+    return Response(data, content_type='application/json; charset=utf-8')
 
     # need to implement for the topic_ids, and also clarify the api back to the front end. Probably still return same thing, and just parse it front. 
     # but problem with this is it is returning the scores of everyone using the card...no good. So you want to actually always only get your scores:
@@ -246,8 +334,14 @@ def get_all_items(request, topic_id = None):
 @permission_classes([IsAuthenticated])
 def get_all_topics(request, user_id=None):
     user = get_user(request, user_id)
-    context = {'request_user': request.user, 'profile_user_id': user.id}
-    data = get_objects(user, request.user, TopicTable, GetTopicTableSerializer, context=context)
+    topics = TopicTable.objects.owned_by(user, request.user).prefetch_related('items', 'collections')
+
+    # all the profile user's scores for these topics in one query, the serializer reads them from the context
+    topic_item_ids = TopicItem.objects.filter(topic__in=topics).values('item_id')
+    scores = dict(UserItem.objects.filter(user=user, item_id__in=topic_item_ids).values_list('item_id', 'score'))
+
+    context = {'request_user': request.user, 'profile_user_id': user.id, 'scores': scores}
+    data = GetTopicTableSerializer(topics, many=True, context=context).data
     return Response(data, content_type='application/json; charset=utf-8')
 
 
@@ -256,7 +350,8 @@ def get_all_topics(request, user_id=None):
 @permission_classes([IsAuthenticated])
 def get_all_collections(request, user_id=None):
     user = get_user(request, user_id)
-    data = get_objects(user, request.user, CollectionTable, CollectionTableSerializer)
+    collections = CollectionTableSerializer.setup_eager_loading(CollectionTable.objects.owned_by(user, request.user))
+    data = CollectionTableSerializer(collections, many=True).data
     return Response(data, content_type='application/json; charset=utf-8')
 
 
@@ -268,7 +363,7 @@ def get_all_collections(request, user_id=None):
 @permission_classes([IsAuthenticated])
 def get_subtopics_collection(request, collection_id):
     user = request.user
-    data = get_objects(user, request.user, CollectionTable, CollectionTableSerializer)
+    data = CollectionTableSerializer(CollectionTable.objects.owned_by(user, request.user), many=True).data
     #user_items = UserItem.objects.filter(user=request.user)
     pass
 
@@ -276,18 +371,16 @@ def get_subtopics_collection(request, collection_id):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_topic_items(request, topic_id):
-    # Fetch the topic
-    topic = get_object_or_404(TopicTable, id=topic_id)
-
-    # Check if the user has access
-    if not has_access(topic, request.user, 'view'):
-        return Response({"error": "Unauthorized topic items access"}, status=401)
+    # Fetch the topic, if the user can see it
+    topic, denied = get_permitted(TopicTable.objects.viewable_by(request.user), topic_id, "Unauthorized topic items access")
+    if denied:
+        return denied
 
     # Fetch the items related to the topic
     topic_items = TopicItem.objects.filter(topic=topic)
 
-    # Serialize the items
-    item_list = [ItemTableSerializer(item.item).data for item in topic_items]
+    # Serialize the items, same output as ItemTableSerializer per item
+    item_list = fast_serializers.topic_item_rows(topic_items)
 
     return Response({"items": item_list}, content_type='application/json; charset=utf-8')
 
@@ -311,13 +404,12 @@ def delete_collection(request):
     if not collection_id:
         return Response({"error": "No collection id provided"}, status=400)
 
-    # Fetch the collection
-    collection = get_object_or_404(CollectionTable, id=collection_id)
-
-    # Check if the user has access
-    if not has_access(collection, request.user, 'edit'):
-        return Response({"error": "Unauthorized Collection"}, status=401)
+    # Fetch the collection, if the user can edit it
+    collection, denied = get_permitted(CollectionTable.objects.editable_by(request.user), collection_id, "Unauthorized Collection")
+    if denied:
+        return denied
     
+    sync.record_collection_delete(collection)
     collection.delete()
 
     return Response({"success": "Collection deleted successfully"}, status=200)
@@ -330,19 +422,17 @@ def delete_topic(request):
     if not topic_id:
         return Response({"error": "No topic id provided"}, status=400)
 
-    # Fetch the collection
-    topic = get_object_or_404(TopicTable, id=topic_id)
-
-    # Check if the user has access
-    if not has_access(topic, request.user, 'edit'):
-        return Response({"error": "Unauthorized Topic"}, status=401)
-
-    # First, delete all CollectionTopic instances associated with the topic
-    CollectionTopic.objects.filter(topic=topic).delete()
-
-    # Then, delete the topic itself
-    topic.delete()
-
+    # Fetch the topic, if the user can edit it
+    topic, denied = get_permitted(TopicTable.objects.editable_by(request.user), topic_id, "Unauthorized Topic")
+    if denied:
+        return denied
+
+    # CollectionTopic instances, then the items (those in no other topic go entirely), then the topic itself,
+    # see jobs.delete_topic. Big topics are left to the job worker
+    size = topic.topicitem_set.count() + CollectionTopic.objects.filter(topic=topic).count()
+    job = jobs.submit('delete_topic', request.user, {'topic_id': topic.id}, size)
+    if job is not None:
+        return Response({"status": "queued", "job": jobs.job_data(job)}, status=202)
     return Response({"success": "Topic deleted successfully"}, status=200)
 
 
@@ -365,7 +455,8 @@ def create_collection(request):
     data["user"] = request.user.id
     serializer = CollectionTableSerializer(data=data, partial=True)
     if serializer.is_valid():
-        serializer.save()
+        collection = serializer.save()
+        sync.record(ChangeLog.COLLECTION, [collection.id], user_id=collection.user_id)
         return Response(serializer.data, status=201)
     return Response(serializer.errors, status=400)
 
@@ -385,7 +476,8 @@ def create_topic(request):
     data["user"] = request.user.id
     serializer = TopicTableSerializer(data=data, partial=True)
     if serializer.is_valid():
-        serializer.save()
+        topic = serializer.save()
+        sync.record(ChangeLog.TOPIC, [topic.id], user_id=topic.user_id)
         return Response(serializer.data, status=201)
     return Response(serializer.errors, status=400)
 
@@ -397,30 +489,37 @@ def edit_topics_in_collection(request):
     collection_id = request.data.get('collection_id')
     topic_edits = request.data.get('topic_edits')
 
-    # Fetch the collection
-    collection = get_object_or_404(CollectionTable, id=collection_id)
+    # Fetch the collection, if the user can edit it
+    collection, denied = get_permitted(CollectionTable.objects.editable_by(request.user), collection_id, "Unauthorized Collection")
+    if denied:
+        return denied
 
-    # Check if the user has access
-    if not has_access(collection, request.user, 'edit'):
-        return Response({"error": "Unauthorized Collection"}, status=401)
-
-    for topic_edit in topic_edits:
-        topic_id, action = topic_edit
-        topic = get_object_or_404(TopicTable, id=topic_id)
-        # Check if the user has access
-        if not has_access(topic, request.user, 'edit'):
-            return Response({"error": "Unauthorized Topic"}, status=401)
-        
+    if not isinstance(topic_edits, list) or not all(isinstance(edit, list) and len(edit) == 2 and is_int(edit[0]) for edit in topic_edits):
+        return Response({"error": "topic_edits should be a list of [topic_id, what] pairs."}, status=400)
+
+    # only the topics the user can edit, in one query, all or nothing
+    topics, denied = get_all_permitted(TopicTable.objects.editable_by(request.user), [topic_id for topic_id, _ in topic_edits], "Unauthorized Topic")
+    if denied:
+        return denied
+
+    # play the edits on {topic_id: is_active}, then write the difference
+    current = dict(collection.collectiontopic_set.values_list('topic_id', 'is_active'))
+    desired = dict(current)
+    for topic_id, action in topic_edits:
         if action == 'add':
-            CollectionTopic.objects.create(collection=collection, topic=topic, is_active=True)
+            desired.setdefault(topic_id, True)
         elif action == 'delete':
-            #collection.topics.remove(topic)
-            CollectionTopic.objects.filter(collection=collection, topic=topic).delete()
+            desired.pop(topic_id, None)
         elif action == 'update':
-            collection_topic = get_object_or_404(CollectionTopic, collection=collection, topic=topic)
-            collection_topic.is_active = not collection_topic.is_active
-            collection_topic.save()
-
+            if topic_id not in desired:
+                raise Http404("No CollectionTopic matches the given query.")
+            desired[topic_id] = not desired[topic_id]
+
+    with transaction.atomic():
+        before = sync.collection_topics_snapshot(collection.id)
+        reconcile_collection_topics(collection, current, desired)
+        sync.record_collection_topics_diff(collection.id, before)
+    study_queue.invalidate_collections([collection.id])
     return Response({"status": "success"}, status=200)
 
 
@@ -437,32 +536,155 @@ def add_items_to_topic(request):
     topic_id = request.data.get('topic_id')
     new_items = request.data.get('items')
 
-    # Fetch the topic
-    topic = get_object_or_404(TopicTable, id=topic_id)
+    # Fetch the topic, if the user can edit it
+    topic, denied = get_permitted(TopicTable.objects.editable_by(request.user), topic_id)
+    if denied:
+        return denied
 
-    # Check if the user has access
-    if not has_access(topic, request.user, 'edit'):
-        return Response({"error": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
+    # validate the whole batch before writing anything
+    if not isinstance(new_items, list):
+        return Response({"error": "items should be a list of [front, back] pairs."}, status=status.HTTP_400_BAD_REQUEST)
+    pairs = []
+    for item in new_items:
+        error = item_pair_error(item)
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+        front, back = item
+        pairs.append((front, back) if front.strip() and back.strip() else None) # Skip blank items
+
+    on_duplicate = request.data.get('on_duplicate', 'create')
+    if on_duplicate not in cards.DUPLICATE_MODES:
+        return Response({"error": f"on_duplicate should be one of {', '.join(cards.DUPLICATE_MODES)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+    # copies of these cards the user can already see, in one lookup
+    kept = [index for index, pair in enumerate(pairs) if pair]
+    new, links, duplicates, repeats = cards.plan_duplicates(request.user, topic, [pairs[index] for index in kept], on_duplicate)
 
     # Check if adding new items exceeds the item limit
     current_item_count = topic.items.count()
-    if current_item_count + len(new_items) > MAX_ITEMS_PER_TOPIC:
+    if current_item_count + len(new) + len(links) > MAX_ITEMS_PER_TOPIC:
         return Response({"error": "Adding these items would exceed the item limit for this topic"}, status=400)
 
-    for item in new_items:
-        try:
-            front, back = item
-            if not front.strip() or not back.strip():
-                continue  # Skip blank items
-        except: 
-            return Response({"error": "Both front and back should be provided."}, status=status.HTTP_400_BAD_REQUEST)
+    # a few INSERTs for the whole batch, all or nothing
+    with transaction.atomic():
+        items = ItemTable.objects.bulk_create([ItemTable(front=pairs[kept[index]][0], back=pairs[kept[index]][1]) for index in new])
+        item_ids = {index: item.id for index, item in zip(new, items)}
+        item_ids.update(links)
+        # linked cards get their UserItems lazily, like any card of a shared topic
+        user_items = UserItem.objects.bulk_create([UserItem(item=item, user_id=user_id) for item in items for user_id in card_holders(request.user, topic)])
+        topic_items = TopicItem.objects.bulk_create([TopicItem(item_id=item_ids[index], topic=topic) for index in new + list(links)])
+
+        sync.record(ChangeLog.ITEM, [item.id for item in items], topic_id=topic.id)
+        sync.record(ChangeLog.TOPIC_ITEM, [topic_item.id for topic_item in topic_items], topic_id=topic.id)
+        sync.record_scoped(ChangeLog.USER_ITEM, [(user_item.id, user_item.user_id) for user_item in user_items], 'user_id')
+    study_queue.invalidate_topics([topic.id])
+
+    # ids line up with the submitted items: the new or linked card, None where a blank item or (with skip) a duplicate
+    # was left out. duplicates lists the items that already had a card, with that card's id
+    duplicates.update({index: item_ids.get(first) for index, first in repeats.items()})
+    if on_duplicate == 'link':
+        item_ids.update(duplicates)
+    response_ids = [None] * len(pairs)
+    for index, item_id in item_ids.items():
+        response_ids[kept[index]] = item_id
+    return Response({
+        "status": "success", "item_ids": response_ids,
+        "duplicates": [{"index": kept[index], "item_id": item_id} for index, item_id in sorted(duplicates.items())],
+    }, status=status.HTTP_200_OK)
+
+
+
+# Import a whole deck file, streamed and written in chunks, see importer.py for the formats
+#-- request: multipart, required {file} optional {topic_id, delimiter}. Without topic_id every row needs a topic column
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def import_items(request):
+    upload = request.FILES.get('file')
+    if upload is None:
+        return Response({"error": "No file provided"}, status=status.HTTP_400_BAD_REQUEST)
+    if upload.size > IMPORT_MAX_BYTES:
+        return Response({"error": f"The file is over {IMPORT_MAX_BYTES // (1024 * 1024)}MB"}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    on_duplicate = request.data.get('on_duplicate') or 'create'
+    if on_duplicate not in cards.DUPLICATE_MODES:
+        return Response({"error": f"on_duplicate should be one of {', '.join(cards.DUPLICATE_MODES)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+    # csv.reader takes a single character, anything else would only fail once the import is running
+    delimiter = request.data.get('delimiter') or None
+    if delimiter is not None and len(delimiter) != 1:
+        return Response({"error": "delimiter should be a single character"}, status=status.HTTP_400_BAD_REQUEST)
+
+    topic = None
+    if request.data.get('topic_id'):
+        topic, denied = get_permitted(TopicTable.objects.editable_by(request.user), request.data.get('topic_id'))
+        if denied:
+            return denied
+
+    # big files go to the job worker, stored in chunks it reads back one at a time (see jobs.py)
+    if upload.size > IMPORT_INLINE_MAX_BYTES:
+        payload = {
+            'topic_id': topic.id if topic else None, 'delimiter': delimiter,
+            'max_items_per_topic': MAX_ITEMS_PER_TOPIC, 'max_topics': MAX_TOPICS_PER_USER, 'on_duplicate': on_duplicate,
+        }
+        job = jobs.enqueue('import_items', request.user, payload, upload=upload)
+        return Response({"status": "queued", "job": jobs.job_data(job)}, status=status.HTTP_202_ACCEPTED)
+
+    try:
+        result = importer.import_file(
+            request.user, upload, delimiter=delimiter, default_topic=topic,
+            max_items_per_topic=MAX_ITEMS_PER_TOPIC, max_topics=MAX_TOPICS_PER_USER, on_duplicate=on_duplicate,
+        )
+    except (UnicodeDecodeError, csv.Error) as e:
+        return Response({"error": f"Could not read the file: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({"status": "success", **result}, status=status.HTTP_200_OK)
 
-        item_instance = ItemTable.objects.create(front=front, back=back)
-        UserItem.objects.create(item=item_instance, user=request.user)
-        TopicItem.objects.create(item=item_instance, topic=topic)
 
-    return Response({"status": "success"}, status=status.HTTP_200_OK)
+# Stream a collection (its topics, their items and your scores) or a single topic, for backups and moving data
+#-- request: required {collection_id or topic_id} optional {export_format: 'ndjson' (default) or 'csv'}
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_items(request):
+    export_format = request.GET.get('export_format', 'ndjson')
+    if export_format not in exporter.EXPORT_FORMATS:
+        return Response({"error": f"export_format should be one of {', '.join(exporter.EXPORT_FORMATS)}"}, status=400)
+
+    collection = None
+    if request.GET.get('collection_id'):
+        collection, denied = get_permitted(CollectionTable.objects.viewable_by(request.user), request.GET.get('collection_id'))
+        if denied:
+            return denied
+        # the owner's private topics stay in their shared collections, only what the caller may view goes out
+        topic_ids = list(collection.collectiontopic_set.filter(viewable_filter(request.user, 'topic__')).values_list('topic_id', flat=True))
+    elif request.GET.get('topic_id'):
+        topic, denied = get_permitted(TopicTable.objects.viewable_by(request.user), request.GET.get('topic_id'))
+        if denied:
+            return denied
+        topic_ids = [topic.id]
+    else:
+        return Response({"error": "collection_id or topic_id is required"}, status=400)
+
+    response = StreamingHttpResponse(
+        exporter.export_lines(export_format, request.user, collection, topic_ids), content_type=exporter.EXPORT_FORMATS[export_format]
+    )
+    name = f"collection_{collection.id}.{export_format}" if collection else f"topic_{topic.id}.{export_format}"
+    response['Content-Disposition'] = f'attachment; filename="{name}"'
+    return response
+
+
+# Status of your background jobs (deleting big topics, unsharing topics, big imports), see jobs.py
+#-- request: none, or {job_id}
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_job(request, job_id):
+    job = get_object_or_404(Job.objects, id=job_id, user=request.user)
+    return Response(jobs.job_data(job))
+
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_all_jobs(request):
+    recent = Job.objects.filter(user=request.user).order_by('-id')[:50]
+    return Response([jobs.job_data(job) for job in recent])
 
 
 #NOT TESTED
@@ -476,12 +698,10 @@ def edit_items_in_topic(request):
     topic_id = request.data.get('topic')
     item_edits = request.data.get('item_edits')
 
-    # Fetch the topic
-    topic = get_object_or_404(TopicTable, id=topic_id) #current db implementation stores items independently so ez to look up
-
-    # Check if the user has access
-    if not has_access(item.topic, request.user, 'edit'):
-        return Response({"error": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
+    # Fetch the topic, if the user can edit it
+    topic, denied = get_permitted(TopicTable.objects.editable_by(request.user), topic_id) #current db implementation stores items independently so ez to look up
+    if denied:
+        return denied
     
     for item_edit in item_edits:
         item_id = item_edit.get('id')
@@ -512,58 +732,57 @@ def edit_items_in_topic_full(request):
     topic_id = request_data.get('topic_id')
     final_items = request_data.get('items')
 
-    # Fetch the topic
-    topic = get_object_or_404(TopicTable, id=topic_id)
-
-    # Check if the user has access
-    if not has_access(topic, request.user, 'edit'):
-        return Response({"error": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED)
+    # Fetch the topic, if the user can edit it
+    topic, denied = get_permitted(TopicTable.objects.editable_by(request.user), topic_id)
+    if denied:
+        return denied
     
-    # Filter out empty items
-    valid_items = [item for item in final_items if item.get('front').strip() and item.get('back').strip()]
-
-    # Calculate the net item count change
-    current_item_ids = set(TopicItem.objects.filter(topic=topic).values_list('item__id', flat=True))
-    new_item_count = sum(1 for item in valid_items if item.get('id') == -1)
-    deleted_item_count = len(current_item_ids) - len(set(item.get('id') for item in valid_items if item.get('id') != -1))
-
-    net_item_change = new_item_count - deleted_item_count
+    # validate everything before touching the database, blank items are left out (and so deleted if they existed)
+    if not isinstance(final_items, list) or not all(isinstance(item, dict) for item in final_items):
+        return Response({"error": "items should be a list of {id, front, back}."}, status=status.HTTP_400_BAD_REQUEST)
+    wanted = []
+    for item in final_items:
+        front, back = item.get('front') or '', item.get('back') or ''
+        error = item_pair_error([front, back])
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+        if front.strip() and back.strip():
+            wanted.append((item.get('id'), front, back))
+
+    # diff against the topic as it is, in one read. Ids that aren't in this topic are ignored
+    current, topic_item_ids = {}, {}
+    for topic_item_id, id, front, back in topic.topicitem_set.values_list('id', 'item_id', 'item__front', 'item__back'):
+        current[id], topic_item_ids[id] = (front, back), topic_item_id
+    new_pairs = [(front, back) for id, front, back in wanted if id == -1]
+    kept = {id: (front, back) for id, front, back in wanted if id in current}
+    updated = {id: pair for id, pair in kept.items() if pair != current[id]}
+    deleted_ids = list(current.keys() - kept.keys())
+    # cards another topic holds too are copied on write, the edit only changes this topic
+    copied = {id: updated.pop(id) for id in cards.shared_elsewhere(topic.id, list(updated))}
 
     # Check if the net change will exceed the limit
-    if topic.items.count() + net_item_change > MAX_ITEMS_PER_TOPIC:
+    if len(kept) + len(new_pairs) > MAX_ITEMS_PER_TOPIC:
         return Response({"error": "Item limit for this topic would be exceeded"}, status=400)
 
-    
+    with transaction.atomic():
+        items = ItemTable.objects.bulk_create([ItemTable(front=front, back=back) for front, back in new_pairs + list(copied.values())])
+        user_items = UserItem.objects.bulk_create([UserItem(item=item, user_id=user_id) for item in items for user_id in card_holders(request.user, topic)])
+        topic_items = TopicItem.objects.bulk_create([TopicItem(item=item, topic=topic) for item in items[:len(new_pairs)]])
+        repointed = [TopicItem(id=topic_item_ids[id], item_id=item.id, topic=topic) for id, item in zip(copied, items[len(new_pairs):])]
+        TopicItem.objects.bulk_update(repointed, ['item'])
+        ItemTable.objects.bulk_update([ItemTable(id=id, front=front, back=back) for id, (front, back) in updated.items()], ['front', 'back', 'content_hash'])
 
-    # For each item in final_items, check if it's an addition or an update
-    new_item_ids = set()
-    for item in final_items:
-        id = item.get('id')
-        front = item.get('front')
-        back = item.get('back')
-
-        if not (front and front.strip()) or not (back and back.strip()):
-            continue  # Skip this item if front or back is blank
-        # Ignore items where both front and back are blank, we counted above, but not removed actually
-        
-        if id == -1:  # New item to be added
-            item_instance = ItemTable.objects.create(front=front, back=back)
-            UserItem.objects.create(item=item_instance, user=request.user)
-            TopicItem.objects.create(item=item_instance, topic=topic)
-            new_item_ids.add(item_instance.id)
-        else:  # Existing item to be updated
-            existing_item = ItemTable.objects.filter(id=id).first()  # Avoid DoesNotExist exception
-            if existing_item is not None:
-                existing_item.front = front
-                existing_item.back = back
-                existing_item.save()
-                new_item_ids.add(id)
-
-    # For deletions, delete the item from ItemTable (also removes UserItem and TopicItem entries due to cascade)
-    for item_id in current_item_ids - new_item_ids:  # IDs present in current items but not in new items
-        ItemTable.objects.filter(id=item_id).delete()
+        sync.record(ChangeLog.ITEM, [item.id for item in items], topic_id=topic.id)
+        sync.record(ChangeLog.TOPIC_ITEM, [topic_item.id for topic_item in topic_items + repointed], topic_id=topic.id)
+        sync.record_scoped(ChangeLog.USER_ITEM, [(user_item.id, user_item.user_id) for user_item in user_items], 'user_id')
+        sync.record_items(updated.keys())
 
-    return Response({"status": "success"}, status=status.HTTP_200_OK)
+        # deleted cards leave this topic, and the database too unless another topic holds them
+        cards.detach_from_topic(topic.id, deleted_ids)
+
+    study_queue.invalidate_topics([topic.id])
+    counts = {"added": len(new_pairs), "updated": len(updated) + len(copied), "unchanged": len(kept) - len(updated) - len(copied), "deleted": len(deleted_ids)}
+    return Response({"status": "success", **counts}, status=status.HTTP_200_OK)
 
 
 # note that this works even if we don't provide the blanks, bcz they will just stay. So therefore, can be used in shared objects
@@ -575,144 +794,183 @@ def edit_topics_in_collection_full(request):
     final_topics = request_data.get('topics')
     print('the inside data is ', collection_id, final_topics)
 
-    # Fetch the collection
-    collection = get_object_or_404(CollectionTable, id=collection_id)
-
-    # Check if the user has access
-    if not has_access(collection, request.user, 'edit'):
-        return Response({"error": "Unauthorized collection"}, status=status.HTTP_401_UNAUTHORIZED)
+    # Fetch the collection, if the user can edit it
+    collection, denied = get_permitted(CollectionTable.objects.editable_by(request.user), collection_id, "Unauthorized collection")
+    if denied:
+        return denied
     
     # Check if the user has access
-    if collection.user != request.user:
+    if collection.user_id != request.user.id:
         return JsonResponse({"error": "Unauthorized"}, status=401)
 
-    # Iterate over final_topics to update/create CollectionTopic instances
+    if not isinstance(final_topics, list) or not all(isinstance(topic, dict) and is_int(topic.get('topic_id')) for topic in final_topics):
+        return Response({"error": "topics should be a list of {topic_id, status}."}, status=400)
+
+    # only the topics the user can edit, in one query, all or nothing
+    topics, denied = get_all_permitted(TopicTable.objects.editable_by(request.user), [topic.get('topic_id') for topic in final_topics], "Unauthorized topic")
+    if denied:
+        return denied
+
+    # the collection ends up holding exactly the listed topics that aren't not_selected
+    # ALTERNATIVE IMPLEMENTATION NEEDED AKA PASS IN not_selected IF WE WANT GLOBALS TO WORK
+    desired = {}
     for topic_data in final_topics:
-        topic_id = topic_data.get('topic_id')
-        status = topic_data.get('status')
-
-        # Fetch the topic
-        topic = get_object_or_404(TopicTable, id=topic_id)
-        
-        if not has_access(topic, request.user, 'edit'):
-            return Response({"error": "Unauthorized topic"}, status=status.HTTP_401_UNAUTHORIZED)
-        
-
-        if status != 'not_selected':
-            # Get the CollectionTopic object or create a new one if it doesn't exist
-            collection_topic, created = CollectionTopic.objects.get_or_create(
-                collection=collection,
-                topic=topic,
-                defaults={'is_active': status == 'active'}
-            )
-            if not created:
-                # Update is_active field
-                collection_topic.is_active = status == 'active'
-                collection_topic.save()
+        if topic_data.get('status') != 'not_selected':
+            desired[topic_data.get('topic_id')] = topic_data.get('status') == 'active'
         else:
-            # Delete the CollectionTopic instance if it exists
-            CollectionTopic.objects.filter(collection=collection, topic=topic).delete()
-
-    #Delete CollectionTopic instances not in final_topics # ALTERNATIVE IMPLEMENTATION NEEDED AKA PASS IN not_selected IF WE WANT GLOBALS TO WORK
-    CollectionTopic.objects.filter(
-        collection=collection
-    ).exclude(
-        topic_id__in=[topic.get('topic_id') for topic in final_topics]
-    ).delete()
+            desired.pop(topic_data.get('topic_id'), None)
 
+    with transaction.atomic():
+        before = sync.collection_topics_snapshot(collection.id)
+        reconcile_collection_topics(collection, dict(collection.collectiontopic_set.values_list('topic_id', 'is_active')), desired)
+        sync.record_collection_topics_diff(collection.id, before)
+    study_queue.invalidate_collections([collection.id])
     return Response({"status": "success"})
 
 
-# Fetch the score, front, and back from the least recent n items in the collection, 
-# that satisfy the property that score < WAIT_SCORE = 5
-#-- request: required {collection_id, n}
+# Fetch the score, front, and back of n_zero random new items and the n_old most overdue items in the collection
+#-- request: required {collection_id, n_old, n_zero} optional {seed}
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def fetch_n_from_collection(request):
     collection_id = request.GET.get('collection_id')
     n_old = int(request.GET.get('n_old'))
     n_zero = int(request.GET.get('n_zero'))
+    seed = request.GET.get('seed') # optional, makes the level 0 sample reproducible
     user = request.user
 
-    collection = get_object_or_404(CollectionTable, id=collection_id)
-    if not has_access(collection, user, 'view'):
-        return Response({"error": "Unauthorized"}, status=401)
-
-    # Get only active topics
-    collection_topics = collection.collectiontopic_set.filter(is_active=True)
-    active_topics_in_collection = [ct.topic for ct in collection_topics]
-
-    # Constants for filtering
-    MAX_SCORE_BACKEND = 8
-    MAX_SCORE_CLIENT = 4
-    LEVEL_A_TIME_FREQUENCY = timedelta(days=7)
-    LEVEL_B_TIME_FREQUENCY = timedelta(minutes=30)
-
-    # Fetch all eligible user items
-    user_items = UserItem.objects.filter(
-        user=user,
-        item__topics__in=active_topics_in_collection,
-    ).select_related('item')
-
-    # Fetch random level 0 items with additional filtering
-    level_zero_items = user_items.filter(score=0).order_by('?')[:n_zero]
-    level_zero_items = [
-        user_item for user_item in level_zero_items
-        if timezone.now() - user_item.last_seen >= LEVEL_B_TIME_FREQUENCY
-    ]
-
-    # Exclude level 0 items from the older items query
-    user_items = user_items.exclude(id__in=[ui.id for ui in level_zero_items])
-
-    # Apply score and time-based filtering for older items
-    user_items = [
-        user_item for user_item in user_items
-        if (
-            (user_item.score == MAX_SCORE_BACKEND and timezone.now() - user_item.last_seen >= LEVEL_A_TIME_FREQUENCY) or
-            (MAX_SCORE_CLIENT <= user_item.score < MAX_SCORE_BACKEND and timezone.now() - user_item.last_seen >= LEVEL_B_TIME_FREQUENCY) or
-            MAX_SCORE_CLIENT > user_item.score
-        )
-    ]
-
-    # Sort and limit results for older items
-    old_items = sorted(user_items, key=lambda ui: ui.last_seen)[:n_old]
-
-    # Combine level zero items and old items
-    combined_items = level_zero_items + old_items
-
-    serializer = UserItemSerializer(combined_items, many=True)
-    return Response(serializer.data, content_type='application/json; charset=utf-8')
+    collection, denied = get_permitted(CollectionTable.objects.viewable_by(user), collection_id)
+    if denied:
+        return denied
+
+    # Items in the active topics the user may see (the owner's private topics stay in their shared collections),
+    # as a subquery so the whole chain stays in the database (and an item in two active topics doesn't show up twice)
+    active_topic_ids = CollectionTopic.objects.filter(collection=collection, is_active=True).filter(viewable_filter(user, 'topic__')).values('topic_id')
+    active_item_ids = TopicItem.objects.filter(topic_id__in=active_topic_ids).values('item_id')
+    user_items = UserItem.objects.filter(user=user, item_id__in=active_item_ids)
+
+    # Serve from the study queue if it has enough left, otherwise rebuild it (seeded requests skip the queue)
+    queued = study_queue.take(user.id, collection.id, n_zero, n_old) if seed is None else None
+    if queued is None:
+        zero_item_ids, old_ids = build_study_queue(user, active_item_ids, n_zero, n_old, seed=seed)
+        queued = zero_item_ids[:n_zero], old_ids[:n_old]
+        if seed is None:
+            # a side that came back short is all there is to study right now, the queue hands out what is left of it
+            exhausted = (n_zero > 0 and len(zero_item_ids) < max(n_zero, study_queue.STUDY_QUEUE_SIZE), len(old_ids) < max(n_old, study_queue.STUDY_QUEUE_SIZE))
+            study_queue.put(user.id, collection.id, zero_item_ids[n_zero:], old_ids[n_old:], exhausted=exhausted)
+
+    # level 0 cards come as item ids, the ones never studied get their UserItem now that they are handed out
+    # (created as just seen, like a card that was just added)
+    combined_ids = materialize_user_items(user, queued[0]) + queued[1]
+
+    # Combine level zero items and old items, same output as UserItemSerializer
+    rows_by_id = {row['id']: row for row in fast_serializers.user_item_rows(user_items.filter(id__in=combined_ids))}
+    data = [rows_by_id[id] for id in combined_ids if id in rows_by_id]
+    return Response(data, content_type='application/json; charset=utf-8')
 
 
 
-# Increments the score, unless score == MAX_SCORE
+# Moves the score up or down a level, see scheduler.py for the rules
 #-- request: required {items -> {item_id, increment} where increment is 1 or -1 
+# (or {card_id, increment} with the ItemTable id, for a card of a shared topic you have no UserItem for yet)
 # the increment could theoretically be a different number, if the deck is small enough it is called multiple times 
 # but that is not good as it bypasses the checks. Hmm... so probably, we should only accept +1
 # it also conveniently works for the top level. Since we update the time, it stays same by overflow if we do +1, and goes down if -1. 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def update_n_items_user(request):
-    MAX_SCORE = 8#int(os.getenv('MAX_SCORE'))
-    MAX_SCORE_CLIENT = 4 #int(os.getenv('MAX_SCORE_CLIENT'))
     items_data = request.data.get("items", [])
+
+    # validate up front, bad entries are reported back rather than failing the whole batch
+    errors = []
+    edits = []
+    card_edits = []
     for item_data in items_data:
         item_id = item_data.get("item_id")
+        card_id = item_data.get("card_id")
         increment = item_data.get("increment")
-        print(item_id, increment)
+        if not (is_int(item_id) or is_int(card_id)) or not is_int(increment):
+            errors.append({"item_id": item_id, "error": "item_id (or card_id) and increment should be integers"})
+            continue
         increment = max(min(1, increment), -1) # don't allow the double trouble on the backend side
-        user_item = get_object_or_404(UserItem, id=item_id, user=request.user)
-        # top level:
-        if user_item.score == MAX_SCORE and increment < 0: 
-            user_item.score = MAX_SCORE_CLIENT
-        # if you fail the B level
-        elif user_item.score >= MAX_SCORE_CLIENT and increment < 0: 
-            user_item.score = MAX_SCORE_CLIENT - 1
-        else: 
-            user_item.score = min(max(0, user_item.score + increment), MAX_SCORE)
-        user_item.last_seen = timezone.now()
-        user_item.save()
-    return Response({"status": "success"})
+        if is_int(item_id):
+            edits.append((item_id, increment))
+        else:
+            card_edits.append((card_id, increment))
+
+    # cards reviewed by ItemTable id, from topics the user can see, get their UserItem on this first review
+    if card_edits:
+        visible = set(
+            TopicItem.objects.filter(item_id__in=[card_id for card_id, _ in card_edits])
+            .filter(viewable_filter(request.user, 'topic__'))
+            .values_list('item_id', flat=True)
+        )
+        errors += [{"card_id": card_id, "error": "Not found"} for card_id, _ in card_edits if card_id not in visible]
+        card_edits = [(card_id, increment) for card_id, increment in card_edits if card_id in visible]
+        user_item_ids = materialize_user_items(request.user, [card_id for card_id, _ in card_edits])
+        edits += [(user_item_id, increment) for user_item_id, (_, increment) in zip(user_item_ids, card_edits)]
+
+    # one read, the transitions in memory, one write
+    now = timezone.now()
+    scheduler = get_scheduler()
+    with transaction.atomic():
+        user_items = UserItem.objects.select_for_update().filter(user=request.user).in_bulk([item_id for item_id, _ in edits])
+        updated = {}
+        reviews = []
+        for item_id, increment in edits:
+            user_item = user_items.get(item_id)
+            if user_item is None:
+                errors.append({"item_id": item_id, "error": "Not found"})
+                continue
+            score_before, last_seen_before = user_item.score, user_item.last_seen
+            user_item.score = scheduler.next_score(user_item.score, increment)
+            user_item.last_seen = now
+            user_item.refresh_due_at()
+            updated[item_id] = user_item
+            reviews.append((user_item.item_id, increment, score_before, user_item.score, last_seen_before))
+        UserItem.objects.bulk_update(updated.values(), ['score', 'last_seen', 'due_at'])
+        sync.record(ChangeLog.USER_ITEM, updated.keys(), user_id=request.user.id)
+    study_queue.invalidate_reviewed(request.user.id, updated.keys(), [user_item.item_id for user_item in updated.values()])
+
+    # history goes through the write-behind buffer, it is written after the response
+    for item_id, increment, score_before, score_after, last_seen_before in reviews:
+        review_log.record(request.user.id, item_id, increment, score_before, score_after, last_seen_before, now)
+
+    return Response({"status": "success", "updated": len(updated), "errors": errors})
+
+# delta sync for offline clients: without a cursor you get all of your items, scores, topics, collections and
+# their memberships, with one only what changed after it (current rows, and ids in deleted for what is gone)
+#-- request: optional {cursor} as returned by the last sync, keep calling while has_more
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def sync_changes(request):
+    cursor = request.GET.get('cursor')
+    if cursor is None:
+        return Response(sync.full_state(request.user))
+    try:
+        cursor = int(cursor)
+    except ValueError:
+        return Response({"error": "Invalid cursor"}, status=400)
+    if sync.cursor_too_old(cursor):
+        return Response({"error": "Cursor too old, sync again without one", "resync": True}, status=status.HTTP_410_GONE)
+    return Response(sync.changes_since(request.user, cursor))
+
+
+# hit/miss counters of the study queue in this process, to see whether it pays for itself
+#-- request: empty
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def study_queue_stats(request):
+    return Response(study_queue.get_stats())
+
+
+# flush counters and timings of the review log buffer in this process, the extra cost of keeping review history
+#-- request: empty
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def review_log_stats(request):
+    return Response(review_log.get_stats())
+
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -720,14 +978,11 @@ def edit_topic_info(request):
     topic_id = request.data.get('topic_id')
     edits = request.data.get('edits')
 
-    # Ensure topic exists and belongs to the authenticated user
-    topic = get_object_or_404(TopicTable, id=topic_id, user=request.user)
+    # Ensure topic exists and belongs to the authenticated user, with what the serializer needs below
+    topic = get_object_or_404(TopicTableSerializer.setup_eager_loading(TopicTable.objects.all()), id=topic_id, user=request.user)
 
-    # Ensure user has edit access
-    if not has_access(topic, request.user, 'edit'):
-        return Response({'detail': 'Not enough permissions'}, status=403)
-        
     # Edit fields
+    was_shared = topic.visibility in SHARED_VISIBILITIES
     if 'visibility' in edits:
         topic.visibility = edits['visibility']
     if 'description' in edits:
@@ -736,9 +991,18 @@ def edit_topic_info(request):
         topic.topic_name = edits['topic_name']
 
     topic.save()
+    sync.record(ChangeLog.TOPIC, [topic.id], user_id=topic.user_id)
+
+    # no longer shared, so it has to leave other people's collections, see jobs.topic_visibility
+    job = None
+    if was_shared and topic.visibility not in SHARED_VISIBILITIES:
+        size = CollectionTopic.objects.filter(topic=topic).exclude(collection__user=topic.user_id).count()
+        job = jobs.submit('topic_visibility', request.user, {'topic_id': topic.id}, size)
 
     # Serialize and return updated topic
     serializer = TopicTableSerializer(topic)
+    if job is not None:
+        return Response({**serializer.data, "job": jobs.job_data(job)}, status=202, content_type='application/json; charset=utf-8')
     return Response(serializer.data, status=200, content_type='application/json; charset=utf-8')
 
 
@@ -749,11 +1013,7 @@ def edit_collection_info(request):
     edits = request.data.get('edits')
 
     # Ensure collection exists and belongs to the authenticated user
-    collection = get_object_or_404(CollectionTable, id=collection_id, user=request.user)
-
-    # Ensure user has edit access
-    if not has_access(collection, request.user, 'edit'):
-        return Response({'detail': 'Not enough permissions'}, status=403)
+    collection = get_object_or_404(CollectionTableSerializer.setup_eager_loading(CollectionTable.objects.all()), id=collection_id, user=request.user)
 
     # Edit fields
     if 'visibility' in edits:
@@ -764,7 +1024,8 @@ def edit_collection_info(request):
         collection.collection_name = edits['collection_name']
 
     collection.save()
+    sync.record(ChangeLog.COLLECTION, [collection.id], user_id=collection.user_id)
 
     # Serialize and return updated collection
-    serializer = (collection)
+    serializer = CollectionTableSerializer(collection)
     return Response(serializer.data, status=200, content_type='application/json; charset=utf-8')